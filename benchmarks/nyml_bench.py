@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+#
+# NYML benchmarks
+#
+# Times every phase of every workload and prints throughput and peak
+# memory. Results can be saved as a baseline and later runs compared
+# against it:
+#
+#   nyml_bench.py --save baseline.json
+#   nyml_bench.py --compare baseline.json
+#
+import argparse
+import copy
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+SRCDIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src'))
+sys.path.insert(0, SRCDIR)
+
+import nyml
+
+
+# Workloads return (data, schema definition, text_key, number of records).
+# Data is what the schema decodes to, the documents are made with dumps().
+
+def wide_dict(scale):
+    n = 2000 * scale
+    return {f'key{i}': f'value {i}' for i in range(n)}, None, None, n
+
+def deep_nesting(scale):
+    # '+' chains, one per level
+    depth = 200
+    data = 'leaf'
+    for i in range(depth):
+        data = [data, str(i)]
+    return [data] * scale, None, None, scale
+
+def multiline(scale):
+    n = 20 * scale
+    text = '\n'.join(f'line {i} of a long text' for i in range(500))
+    return {f'text{i}': text for i in range(n)}, None, None, n
+
+def big_list(scale):
+    n = 20000 * scale
+    return [f'item {i}' for i in range(n)], None, None, n
+
+def front_matter(scale):
+    body = ''.join(f'Body line {i}, some words to fill it up.\n'
+                   for i in range(20000 * scale))
+    data = {'title': 'Front matter',
+            'tags': ['a', 'b', 'c'],
+            'text': body}
+    return data, {'type': 'dict',
+                  'schemas': {'title': {},
+                              'tags': {'type': 'list'},
+                              'text': {}}}, 'text', 1
+
+def typed(scale):
+    n = 2000 * scale
+    schema = {'type': 'list',
+              'schema': {'type': 'dict',
+                         'schemas': {'id': {'type': 'int'},
+                                     'name': {},
+                                     'enabled': {'type': 'bool'},
+                                     'count': {'type': 'int',
+                                               'default': '1'},
+                                     'tags': {'type': 'list',
+                                              'schema': {'type': 'str'}},
+                                     'limits': {'type': 'dict',
+                                                'schema': {'type': 'int'}}}}}
+    data = [{'id': i,
+             'name': f'record {i}',
+             'enabled': i % 2 == 0,
+             'count': i % 5,
+             'tags': ['x', 'y'] if i % 3 else [],
+             'limits': {'low': i, 'high': i * 2}}
+            for i in range(n)]
+    return data, schema, None, n
+
+WORKLOADS = {
+    'wide_dict': wide_dict,
+    'deep_nesting': deep_nesting,
+    'multiline': multiline,
+    'big_list': big_list,
+    'front_matter': front_matter,
+    'typed': typed,
+}
+
+
+def make_phases(data, schema, text_key):
+    # Every phase is (setup, run), setup() prepares the argument of run()
+    # outside of the timed region.
+    text = nyml.dumps(copy.deepcopy(data), schema, text_key)
+    raw = nyml.loads(text, text_key=text_key)
+
+    phases = {
+        'parse': (lambda: text,
+                  lambda text: nyml.loads(text, text_key=text_key)),
+        'dump': (lambda: copy.deepcopy(raw),
+                 lambda raw: nyml.dumps(raw, None, text_key)),
+    }
+    if schema is not None:
+        phases.update({
+            'decode': (lambda: copy.deepcopy(raw),
+                       lambda raw: schema.decode(raw)),
+            'encode': (lambda: copy.deepcopy(data),
+                       lambda data: schema.encode(data)),
+            'load': (lambda: text,
+                     lambda text: nyml.loads(text, schema, text_key)),
+        })
+        if text_key is None:
+            dumper = schema.compile_dumper()
+            phases['dump_compiled'] = (lambda: copy.deepcopy(data), dumper)
+    phases['roundtrip'] = (
+            lambda: copy.deepcopy(data),
+            lambda data: nyml.loads(nyml.dumps(data, schema, text_key),
+                                    schema, text_key))
+    return text, phases
+
+def measure(setup, run, repeat):
+    times = []
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            arg = setup()
+            start = time.perf_counter()
+            run(arg)
+            times.append(time.perf_counter() - start)
+            gc.collect()
+    finally:
+        gc.enable()
+
+    arg = setup()
+    tracemalloc.start()
+    try:
+        run(arg)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return min(times), statistics.median(times), peak
+
+def run_benchmarks(names, scale, repeat):
+    results = {}
+    for name in names:
+        data, definition, text_key, records = WORKLOADS[name](scale)
+        schema = nyml.make_schema(definition) if definition else None
+        text, phases = make_phases(data, schema, text_key)
+        size = len(text.encode('utf-8'))
+
+        for phase, (setup, run) in phases.items():
+            best, median, peak = measure(setup, run, repeat)
+            results[f'{name}.{phase}'] = {
+                'seconds': best,
+                'median': median,
+                'mb_per_s': size / best / 1e6,
+                'records_per_s': records / best,
+                'peak_kib': peak / 1024,
+            }
+    return results
+
+def print_results(results, baseline=None):
+    print(f'{"benchmark":28} {"ms":>9} {"MB/s":>8} {"records/s":>11}'
+          f' {"peak KiB":>9}' + (' {:>8}'.format('change') if baseline else ''))
+    for key, r in results.items():
+        line = (f'{key:28} {r["seconds"] * 1000:9.2f} {r["mb_per_s"]:8.2f}'
+                f' {r["records_per_s"]:11.0f} {r["peak_kib"]:9.0f}')
+        if baseline:
+            base = baseline.get(key)
+            if base is None:
+                line += '      new'
+            else:
+                change = r['seconds'] / base['seconds'] - 1
+                line += f' {change:+8.1%}'
+        print(line)
+
+def regressions(results, baseline, threshold):
+    return [key for key, r in results.items()
+            if key in baseline
+            and r['seconds'] > baseline[key]['seconds'] * (1 + threshold)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='NYML benchmarks')
+    parser.add_argument('workloads', nargs='*', metavar='WORKLOAD',
+                        help=f'workloads to run ({", ".join(WORKLOADS)})')
+    parser.add_argument('--scale', type=int, default=1,
+                        help='size multiplier of the documents')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='runs of each phase, the best one is reported')
+    parser.add_argument('--save', metavar='FILE',
+                        help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare the results with a baseline')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown against the baseline taken as a'
+                             ' regression (default 0.1 for 10%%)')
+    args = parser.parse_args()
+
+    names = args.workloads or list(WORKLOADS)
+    for name in names:
+        if name not in WORKLOADS:
+            parser.error(f'unknown workload {name}')
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    results = run_benchmarks(names, args.scale, args.repeat)
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': sys.version.split()[0],
+                       'scale': args.scale,
+                       'results': results}, f, indent=2)
+
+    if baseline:
+        slower = regressions(results, baseline, args.threshold)
+        if slower:
+            print(f'regressions: {", ".join(slower)}')
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,232 +1,332 @@
 import copy
+import itertools
+import re
+import time
 
 from .exceptions import *
-from .schema import make_schema
-
-def loads(s, schema=None, text_key=None):
+from .cache import DocumentCache
+from .editable import EditableDocument
+from .emitter import BUFFER_SIZE, BufferedWriter, emit
+from .frozen import FrozenDict, FrozenList, freeze
+from .lazy import LazyDict, LazyList, materialize
+from .parallel import load_all_file, load_many
+from .parser import EventParser, IncrementalLoader, Parser, apply_schema
+from .positions import IndexingParser, PositionIndex, locate_violation
+from .records import Record
+from .schema import SchemaCache, make_schema
+from .select import SelectParser, apply_selection, make_selection
+from .snapshot import SnapshotCache
+from .stats import CountingLines, Stats
+from .text import LazyText
+
+def __getattr__(name):
+    # aload() and adump() import asyncio, which takes long, on first use
+    if name in ('aload', 'adump'):
+        from . import aio
+        return getattr(aio, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+def loads(s, schema=None, text_key=None, lazy=False, select=None,
+          frozen=False, records=False, stats=None):
     lines = s.splitlines(keepends=True)
-    return load(lines, schema, text_key)
-
-def load(fp, schema=None, text_key=None):
-    def finish_element(new_indent, line):
-        nonlocal indent, stack, element
-        while new_indent < indent:
-            if isinstance(stack[-1][1], list):
-                stack[-1][1].append(element)
-            elif isinstance(stack[-1][1], str):
-                if new_indent == stack[-1][0] and line and line[0] in '-+' \
-                        and element is None:
-                    indent = new_indent
-                    return
-                _, key = stack.pop()
-                stack[-1][1][key] = element
-            indent, element = stack.pop()
-
-        if isinstance(element, list) and (not line or line[0] not in '-+') and stack:
-            if isinstance(stack[-1][1], list):
-                stack[-1][1].append(element)
-            elif isinstance(stack[-1][1], str):
-                _, key = stack.pop()
-                stack[-1][1][key] = element
-            indent, element = stack.pop()
-
-    def remove_marker(line):
-        return line[2:] if line[1:2] == ' ' else line[1:]
-
-    def parse_line(line):
-        nonlocal indent, stack, element
-        if isinstance(element, str):
-            element += '\n' + line
-        elif line and line[0] in '-+':
-            if element is None:
-                element = []
-            elif not isinstance(element, list):
-                raise ParseError('unexpected list')
-            stack.append([indent, element])
-            indent += 2
-            if line[0] == '-':
-                element = remove_marker(line)
+    return load(lines, schema, text_key, lazy, select, frozen, records, stats)
+
+# Everything up to the last line break, and the next line break, as
+# universal newlines mode sees them
+_LINES = re.compile(rb'.*[\r\n]', re.DOTALL)
+_LINE_BREAK = re.compile(rb'[\r\n]')
+# Lines with their line breaks, the last one may have none
+_RAW_LINES = re.compile(rb'[^\r\n]*(?:\r\n|[\r\n])|[^\r\n]+')
+_BLANK_LINES = (b'\n', b'\r\n', b'\r')
+
+LOADB_BLOCK_SIZE = 64 * 1024
+
+def _decode_lines(data, encoding):
+    text = str(data, encoding)
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+def loadb(buffer, schema=None, text_key=None, encoding='utf-8',
+          block_size=LOADB_BLOCK_SIZE):
+    # Parses bytes, bytearray, memoryview or mmap without decoding it as a
+    # whole. The header is decoded in blocks of whole lines taken from a view
+    # of the buffer, the body only if it is kept. The encoding has to keep
+    # line breaks single bytes.
+    parser = Parser()
+    body = ''
+
+    with memoryview(buffer) as view:
+        view = view.cast('B')
+        size = len(view)
+        pos = 0
+        while pos < size:
+            end = pos + block_size
+            if end >= size:
+                end = size
             else:
-                element = None
-                parse_line(remove_marker(line))
-        else:
-            parts = line.split(':', 1)
-            if len(parts) == 1:
-                if element is None:
-                    element = line
-                else:
-                    raise ParseError('unexpected string')
+                match = _LINES.match(view, pos, end)
+                if match is None:
+                    # A line longer than the block
+                    match = _LINE_BREAK.search(view, end)
+                end = match.end() if match else size
+                if end < size and view[end - 1] == 13 and view[end] == 10:
+                    end += 1
+
+            text = _decode_lines(view[pos:end], encoding)
+            pos = end
+            lines = text.split('\n')
+            if not lines[-1]:
+                lines.pop()
+
+            for i, line in enumerate(lines):
+                if not line:
+                    break
+                parser.feed(line)
             else:
-                if element is None:
-                    element = {}
-                elif not isinstance(element, dict):
-                    raise ParseError('unexpected dict')
-
-                key, value = parts
-                if value and value[0] == ' ':
-                    value = value[1:]
-                if not value:
-                    value = None
-
-                stack.append([indent, element])
-                stack.append([indent, key])
-                indent += 2
-                element = value
-
-    indent = 0
-    stack = []
-    element = None
-
-    for lineno, line in enumerate(fp, start=1):
+                continue
+
+            if text_key is not None:
+                offset = sum(len(line) + 1 for line in lines[:i + 1])
+                body = text[offset:] + _decode_lines(view[pos:], encoding)
+            break
+
+        element = parser.close()
+
+    if text_key is not None:
+        element[text_key] = body
+
+    return apply_schema(element, schema)
+
+def _check_modes(lazy, select, frozen, records):
+    # The decoding modes of load() exclude each other. Selected elements
+    # are decoded by themselves and can only be frozen after.
+    modes = [name for name, value in (('lazy', lazy), ('frozen', frozen),
+                                      ('records', records))
+             if value]
+    if select is not None:
+        modes = ['select'] + [name for name in modes if name != 'frozen']
+    if len(modes) > 1:
+        raise ValueError(f'{modes[0]} and {modes[1]} cannot be combined')
+
+def load(fp, schema=None, text_key=None, lazy=False, select=None,
+         frozen=False, records=False, stats=None):
+    _check_modes(lazy, select, frozen, records)
+    if stats is not None:
+        fp = CountingLines(fp)
+        start = time.perf_counter()
+
+    if select is not None:
+        data = load_selected(fp, schema, text_key, select)
+        if stats is not None:
+            stats.add_time('load', time.perf_counter() - start)
+            stats.add(lines=fp.count, input_chars=fp.chars)
+        return freeze(data) if frozen else data
+
+    parser = Parser()
+    lines = iter(fp)
+
+    for line in lines:
         line = line.rstrip('\n')
 
         if not line:
             break
 
-        next_indent = indent + 2
-        no_indent_line = line.lstrip()
-        line_indent = len(line) - len(no_indent_line)
+        parser.feed(line)
+
+    element = parser.close()
 
-        if line_indent > next_indent:
-            no_indent_line = ' '*(line_indent - next_indent) + no_indent_line
-            line_indent = next_indent
-        elif line_indent > indent:
-            no_indent_line = ' '*(line_indent - indent) + no_indent_line
-            line_indent = indent
+    if text_key is not None:
+        element[text_key] = ''.join(lines)
+
+    if stats is not None:
+        # Node counts are taken outside of the timed phases
+        stats.add_time('parse', time.perf_counter() - start)
+        stats.add(lines=fp.count, input_chars=fp.chars)
+        stats.count_nodes(element)
+        start = time.perf_counter()
+
+    data = apply_schema(element, schema, lazy, frozen, records, stats)
+
+    if stats is not None:
+        stats.add_time('decode', time.perf_counter() - start)
+    return data
+
+def load_all(fp, schema=None, lazy=False, frozen=False, records=False,
+             stats=None):
+    # Yields the documents of a stream, each ended by a blank line or the
+    # end of the stream. A blank line on its own is an empty document, as
+    # dump_all() writes for records that dump to nothing. Every document is
+    # parsed by load(), which stops at the blank line after it, so only one
+    # document is held at a time.
+    lines = iter(fp)
+    for line in lines:
+        yield load(itertools.chain((line,), lines), schema, None, lazy, None,
+                   frozen, records, stats)
+
+def load_selected(fp, schema, text_key, select):
+    selection = make_selection(select)
+    parser = SelectParser(selection)
+    lines = iter(fp)
+
+    for line in lines:
+        line = line.rstrip('\n')
+
+        if not line:
+            break
 
-        finish_element(line_indent, no_indent_line)
+        parser.feed(line)
 
-        try:
-            parse_line(no_indent_line)
-        except ParseError as e:
-            raise ParseError(f'{e} at line {lineno}: {line}')
+        if parser.done:
+            if text_key is not None:
+                # The body has to be found still
+                for line in lines:
+                    if not line.rstrip('\n'):
+                        break
+            break
 
-    finish_element(0, '')
+    element = parser.close()
 
     if text_key is not None:
-        element[text_key] = ''.join(fp)
+        element[text_key] = ''.join(lines)
+
+    return apply_selection(element, schema, selection)
+
+def load_file(path, schema=None, text_key=None, lazy_text=False,
+              encoding='utf-8', index=None):
+    if index is None and (not lazy_text or text_key is None):
+        with open(path, encoding=encoding) as fp:
+            return load(fp, schema, text_key)
+
+    parser = Parser() if index is None else IndexingParser(index)
+
+    with open(path, 'rb') as fp:
+        # The header is decoded in one piece, its lines break at the same
+        # places in bytes as in text. Lines are split as universal newlines
+        # mode splits them, offset ends up at the start of the body.
+        header = []
+        offset = 0
+        for raw_line in fp:
+            raw_lines = _RAW_LINES.findall(raw_line) if b'\r' in raw_line \
+                    else (raw_line,)
+            for line in raw_lines:
+                offset += len(line)
+                if line in _BLANK_LINES:
+                    break
+                header.append(line)
+            else:
+                continue
+            break
 
-    if schema is None:
-        return element
-    elif element is None:
-        return schema.get_default()
-    else:
-        return schema.decode(element)
+        lines = _decode_lines(b''.join(header), encoding).split('\n')
+        if not lines[-1]:
+            lines.pop()
+        for line in lines:
+            parser.feed(line)
 
-def dumps(data, schema=None, text_key=None):
-    parts = []
-    indent = 0
-
-    def save_type(data, schema=None, collapse=False):
-        if isinstance(data, dict):
-            save_dict(data, schema, collapse)
-        elif isinstance(data, list):
-            save_list(data, schema, collapse)
-        elif data is None:
-            parts.append('\n')
-        else:
-            lines = str(data).split('\n')
-            if lines:
-                if collapse:
-                    parts.append(lines[0])
-                    parts.append('\n')
-                prefix = ' '*indent
-                for line in lines[1 if collapse else 0:]:
-                    parts.append(prefix)
-                    parts.append(line)
-                    parts.append('\n')
-
-    def save_dict(dct, schema, collapse):
-
-        def save_dict_item(dct, key):
-            nonlocal parts, indent
-            strkey = str(key)
-            if strkey.startswith(('-', '+', '>')) \
-                    or strkey.find(':') != -1 \
-                    or strkey.find('\n') != -1:
-                raise KeyError
-
-            item_schema = schema.get_item_schema(key) \
-                    if schema is not None \
-                    else None
-
-            if isinstance(dct[key], dict):
-                parts.append('\n')
-                indent += 2
-                save_type(dct[key], item_schema)
-                indent -= 2
-            elif isinstance(dct[key], list):
-                parts.append('\n')
-                save_type(dct[key], item_schema)
-            elif dct[key] is None:
-                parts.append('\n')
+        element = parser.close()
+
+        if text_key is not None:
+            if lazy_text:
+                element[text_key] = LazyText(path, offset, encoding)
             else:
-                indent += 2
-                value = str(dct[key])
-                collapse = True
-                # First line needs to be doubled if it's empty. This will allow
-                # parser to distinguish a string from a dict or list when it's
-                # a dict item.
-                if value and value[0] == '\n':
-                    parts.append('\n')
-                    collapse = False
-                else:
-                    parts.append(' ')
-                save_type(value, item_schema, collapse)
-                indent -= 2
-
-        if schema is not None and schema.schemas:
-            keys = [k for k in schema.schemas.keys() if k in dct.keys()]
-            keys += [k for k in dct.keys() if k not in keys]
+                fp.seek(offset)
+                element[text_key] = _decode_lines(fp.read(), encoding)
+
+    if index is None:
+        return apply_schema(element, schema)
+
+    # Byte offsets of the header lines, counted from 1
+    parser.resolve(list(itertools.accumulate(
+            itertools.chain((0, 0), map(len, header)))))
+
+    try:
+        return apply_schema(element, schema)
+    except SchemaViolation as e:
+        _, lineno = locate_violation(element, schema, e, index)
+        if lineno is None:
+            raise
+        raise SchemaViolation(f'{e} at line {lineno}') from e
+
+def load_subtree(path, index, node, schema=None, encoding='utf-8'):
+    # Parses only the lines of one element found in the index
+    node = index.normalize(node)
+    _, start, end, indent = index[node]
+
+    with open(path, 'rb') as fp:
+        fp.seek(start)
+        text = _decode_lines(fp.read(end - start), encoding)
+
+    parser = Parser()
+    lines = text.split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    for i, line in enumerate(lines):
+        # The key or list marker of the element is at column indent of the
+        # first line, unless the line is indented more than the element is
+        # nested. Spaces the key starts with are part of the indentation
+        # then. The lines after it are indented at least as much as the
+        # element.
+        no_indent_line = line.lstrip(' ')
+        line_indent = len(line) - len(no_indent_line)
+        if i == 0:
+            key = node[-1]
+            column = indent
+            if isinstance(key, str):
+                if not line.startswith(key + ':', indent):
+                    column = line_indent - (len(key) - len(key.lstrip(' ')))
+            elif line[indent:indent + 1] not in ('-', '+'):
+                column = line_indent
+            line = line[column:]
         else:
-            keys = list(dct.keys())
-
-        if keys:
-            if collapse:
-                parts.append(str(keys[0]) + ':')
-                save_dict_item(dct, keys[0])
-            for key in keys[1 if collapse else 0:]:
-                parts.append(' '*indent + str(key) + ':')
-                save_dict_item(dct, key)
-
-    def save_list(lst, schema, collapse):
-        item_schema = schema.get_item_schema() if schema is not None else None
-
-        def save_list_item(item):
-            nonlocal indent
-            indent += 2
-            save_type(item, item_schema, collapse=True)
-            indent -= 2
-
-        def marker(item):
-            if isinstance(item, list) or isinstance(item, dict):
-                return '+ '
-            else:
-                return '- '
+            line = line[min(indent, line_indent):]
+        parser.feed(line)
 
-        if lst:
-            if collapse:
-                parts.append(marker(lst[0]))
-                save_list_item(lst[0])
-            for item in lst[1 if collapse else 0:]:
-                parts.append(' '*indent + marker(item))
-                save_list_item(item)
+    element = parser.close()
+    element = element[node[-1]] if isinstance(element, dict) else element[0]
+    return apply_schema(element, schema)
 
-    if data is not None and data != '':
-        text = None
-        if text_key is not None and isinstance(data, dict):
-            text = data.pop(text_key, None)
+def iterparse(fp):
+    parser = EventParser()
+    events = parser.events
 
-        if schema is not None:
-            data = schema.encode(data)
+    for line in fp:
+        line = line.rstrip('\n')
 
-        save_type(data, schema, collapse=False)
+        if not line:
+            break
 
-        if text:
-            parts.append('\n')
-            parts.append(text.replace('\r\n', '\n'))
+        parser.feed(line)
 
+        if events:
+            yield from events
+            events.clear()
+
+    parser.close()
+    yield from events
+
+def dumps(data, schema=None, text_key=None, stats=None):
+    parts = []
+    emit(data, parts.append, schema, text_key, stats)
     return ''.join(parts)
 
-def dump(obj, fp, schema=None, text_key=None):
-    fp.write(dumps(obj, schema, text_key))
+def dump(obj, fp, schema=None, text_key=None, buffer_size=BUFFER_SIZE,
+         stats=None):
+    writer = BufferedWriter(fp, buffer_size)
+    emit(obj, writer.write, schema, text_key, stats)
+    writer.flush()
+
+def dump_all(records, fp, schema=None, buffer_size=BUFFER_SIZE, stats=None):
+    # Every record is followed by a blank line, so that streams can be
+    # appended to. Records are dumped one at a time to check that they end
+    # in a line break and contain no blank line of their own.
+    writer = BufferedWriter(fp, buffer_size)
+    for record in records:
+        text = dumps(record, schema, None, stats)
+        if text.startswith('\n') or text.find('\n\n') != -1:
+            raise ValueError(f'record {record!r} contains a blank line')
+        if text and not text.endswith('\n'):
+            text += '\n'
+        writer.write(text)
+        writer.write('\n')
+    writer.flush()
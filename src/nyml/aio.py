@@ -0,0 +1,103 @@
+import asyncio
+import threading
+
+from .emitter import BUFFER_SIZE, BufferedWriter, emit
+from .parser import IncrementalLoader
+
+# Chunks of output queued ahead of the writer
+QUEUE_DEPTH = 2
+
+async def aload(reader, schema=None, text_key=None, encoding='utf-8',
+                chunk_size=BUFFER_SIZE):
+    # Lines are parsed as chunks of the stream arrive. Reading stops at the
+    # end of the header unless the body is needed, as load() does.
+    loader = IncrementalLoader(schema, text_key, encoding)
+    while not loader.done:
+        chunk = await reader.read(chunk_size)
+        if not chunk:
+            break
+        loader.feed(chunk)
+        # Chunks already buffered by the reader are returned without
+        # suspending
+        await asyncio.sleep(0)
+    return loader.close()
+
+
+class _Aborted(Exception):
+    pass
+
+
+async def adump(obj, writer, schema=None, text_key=None,
+                buffer_size=BUFFER_SIZE, encoding='utf-8'):
+    # Documents that fit in one buffer are written right away
+    parts = []
+    size = 0
+
+    def collect(s):
+        nonlocal size
+        size += len(s)
+        if size > buffer_size:
+            raise _Aborted
+        parts.append(s)
+
+    # emit() pops text_key, so the attempt works on a copy of the caller's
+    # dict and the threaded emit() below still finds the text
+    first = obj
+    if text_key is not None and isinstance(obj, dict):
+        first = dict(obj)
+    try:
+        emit(first, collect, schema, text_key)
+    except _Aborted:
+        pass
+    else:
+        writer.write(''.join(parts).encode(encoding))
+        await writer.drain()
+        return
+
+    # Otherwise emit() runs in a thread of its own and hands over chunks of
+    # about buffer_size characters. It is held up while QUEUE_DEPTH chunks
+    # wait for the writer to drain, so the output is never buffered as a
+    # whole. obj must not be changed until adump() returns.
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    slots = threading.Semaphore(QUEUE_DEPTH)
+    aborted = False
+    done = object()
+
+    class Channel:
+        def write(self, s):
+            slots.acquire()
+            if aborted:
+                raise _Aborted
+            loop.call_soon_threadsafe(queue.put_nowait, s)
+
+    def produce():
+        try:
+            buffered = BufferedWriter(Channel(), buffer_size)
+            emit(obj, buffered.write, schema, text_key)
+            buffered.flush()
+            result = done
+        except _Aborted:
+            return
+        except BaseException as e:
+            result = e
+        loop.call_soon_threadsafe(queue.put_nowait, result)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is done:
+                break
+            if isinstance(chunk, BaseException):
+                raise chunk
+            writer.write(chunk.encode(encoding))
+            slots.release()
+            await writer.drain()
+            await asyncio.sleep(0)
+    except BaseException:
+        # Wakes the thread up if it waits for a slot
+        aborted = True
+        slots.release()
+        raise
@@ -0,0 +1,77 @@
+import collections
+import marshal
+import os
+import threading
+
+class DocumentCache:
+    # Parsed documents by (path, schema, text_key). An entry is valid while
+    # the file's (st_mtime_ns, st_size, st_ino) stay the same. Trees are kept
+    # marshalled, callers get a new copy every time and are free to modify
+    # it. Unmarshalling is several times faster than a deep copy.
+    def __init__(self, maxsize=128, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def load(self, path, schema=None, text_key=None):
+        from . import load_file
+
+        st = os.stat(path)
+        fingerprint = (st.st_mtime_ns, st.st_size, st.st_ino)
+        key = (os.fspath(path), schema, text_key)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == fingerprint:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return marshal.loads(entry[1])
+            self.misses += 1
+
+        # Parsing is done outside the lock, a concurrent load of the same
+        # file just stores the same result twice.
+        data = load_file(path, schema, text_key)
+        blob = marshal.dumps(data)
+
+        with self.lock:
+            self.discard(key)
+            # Entries are charged the size of their marshalled tree, which
+            # may well exceed that of the file
+            self.entries[key] = (fingerprint, blob, len(blob))
+            self.size += len(blob)
+            self.evict()
+        return data
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def evict(self):
+        while len(self.entries) > 1 and (
+                (self.maxsize is not None and len(self.entries) > self.maxsize)
+                or (self.maxbytes is not None and self.size > self.maxbytes)):
+            _, (_, _, size) = self.entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+
+    def invalidate(self, path=None):
+        with self.lock:
+            if path is None:
+                self.entries.clear()
+                self.size = 0
+                return
+            path = os.fspath(path)
+            for key in [key for key in self.entries if key[0] == path]:
+                self.discard(key)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self.entries), 'bytes': self.size}
@@ -0,0 +1,231 @@
+import bisect
+import operator
+
+from .exceptions import *
+from .frozen import FrozenDict, FrozenList, freeze
+from .parser import Parser, _Text, apply_schema
+from .schema import NymlDictSchema, NymlListSchema
+
+# Entries are [key, value, decoded]
+_KEY = operator.itemgetter(0)
+_VALUE = operator.itemgetter(1)
+
+class _EntryParser(Parser):
+    # Records the first line and the value of every top level entry, that
+    # is every key of a dict or item of a list at the root.
+    def __init__(self):
+        super().__init__()
+        self.starts = []
+        self.entries = []
+
+    def parse_line(self, line):
+        depth = len(self.stack)
+        super().parse_line(line)
+        if not depth and self.stack:
+            self.starts.append(self.lineno - 1)
+
+    def attach(self, parent, key, element):
+        if type(element) is _Text:
+            element = str(element)
+        if not self.stack:
+            self.entries.append([key, element, False])
+        if key is None:
+            parent.append(element)
+        else:
+            parent[key] = element
+
+
+class EditableDocument:
+    # Keeps the lines of a document with the line ranges and decoded values
+    # of its top level entries. An edit re-parses and decodes only the
+    # entries its lines belong to, plus the one before, since an edit at
+    # the start of an entry may continue the previous one. Documents that
+    # are no dict or list, and edits touching the end of the header, are
+    # parsed again as a whole. Results are decoded as with frozen=True, as
+    # values of the entries an edit leaves alone are shared with the
+    # previous result.
+    def __init__(self, text, schema=None):
+        self.schema = schema
+        self.lines = self.split(text)
+        self.reload()
+
+    def split(self, text):
+        # Lines as load() sees them
+        return [line.rstrip('\n') for line in text.splitlines(keepends=True)]
+
+    def reload(self):
+        lines = self.lines
+        self.header_end = lines.index('') if '' in lines else len(lines)
+        parser = self.parse(lines[:self.header_end])
+        element = parser.close()
+
+        schema = self.schema
+        self.incremental = isinstance(element, (dict, list)) and (
+                schema is None
+                or isinstance(element, dict)
+                and isinstance(schema, NymlDictSchema)
+                or isinstance(element, list)
+                and isinstance(schema, NymlListSchema))
+
+        if not self.incremental:
+            self.data = apply_schema(element, schema, frozen=True)
+            return self.data
+
+        self.root_type = type(element)
+        self.starts = parser.starts
+        self.entries = entries = parser.entries
+        if self.root_type is list:
+            self.decode(entries)
+            self.data = FrozenList(map(_VALUE, entries))
+        else:
+            latest = self.latest_entries(entries)
+            self.decode(list(latest.values()), latest)
+            self.data = self.build(latest)
+            self.latest = latest
+        return self.data
+
+    def replace(self, start, end, new_lines):
+        old_lines = self.lines[start:end]
+        self.lines[start:end] = new_lines
+        try:
+            return self.reload()
+        except:
+            self.lines[start:start + len(new_lines)] = old_lines
+            self.reload()
+            raise
+
+    def parse(self, lines):
+        parser = _EntryParser()
+        for line in lines:
+            parser.feed(line)
+        return parser
+
+    def edit(self, start, end, text):
+        # Replaces lines start to end (exclusive) with the lines of text and
+        # returns the updated document.
+        new_lines = self.split(text)
+
+        # The end of the header may move
+        if not self.incremental or '' in new_lines or not self.entries \
+                or end > self.header_end \
+                or end == self.header_end < len(self.lines):
+            return self.replace(start, end, new_lines)
+
+        lines = self.lines
+        starts = self.starts
+        first = max(bisect.bisect_right(starts, max(start - 1, 0)) - 1, 0)
+        last = bisect.bisect_right(starts, max(end - 1, 0)) - 1
+        # Entries starting with an indented line are parsed differently on
+        # their own, they go together with the entry before them.
+        while first > 0 and lines[starts[first]][:1].isspace():
+            first -= 1
+        while last + 1 < len(starts) and lines[starts[last + 1]][:1].isspace():
+            last += 1
+        chunk_start = starts[first]
+        chunk_end = starts[last + 1] if last + 1 < len(starts) \
+                else self.header_end
+
+        chunk = lines[chunk_start:start] + new_lines + lines[end:chunk_end]
+        parser = self.parse(chunk)
+        element = parser.close()
+        old_entries = self.entries[first:last + 1]
+        new_entries = parser.entries
+        if element is not None and type(element) is not self.root_type \
+                or not new_entries and len(old_entries) == len(self.entries):
+            # Nothing is left of the header, or the root type changes
+            return self.replace(start, end, new_lines)
+
+        # Values are decoded before anything is changed, so that a failed
+        # edit leaves the document as it was
+        if self.root_type is list:
+            self.decode(new_entries)
+            data = self.data[:first] + [entry[1] for entry in new_entries] \
+                    + self.data[last + 1:]
+            data = FrozenList(data)
+        elif list(map(_KEY, old_entries)) == list(map(_KEY, new_entries)):
+            # The keys stay in place, only values change
+            latest = self.latest
+            changed = [new for old, new in zip(old_entries, new_entries)
+                       if latest[old[0]] is old]
+            self.decode(changed, latest)
+            data = dict(self.data)
+            for entry in changed:
+                latest[entry[0]] = entry
+                data[entry[0]] = entry[1]
+            data = FrozenDict(data)
+        else:
+            entries = self.entries[:first] + new_entries \
+                    + self.entries[last + 1:]
+            latest = self.latest_entries(entries)
+            # Removed entries may uncover an earlier one with the same key
+            keys = dict.fromkeys(map(_KEY, old_entries + new_entries))
+            self.decode([latest[key] for key in keys
+                         if key in latest and not latest[key][2]], latest)
+            data = self.build(latest)
+            self.latest = latest
+
+        delta = len(new_lines) - (end - start)
+        lines[start:end] = new_lines
+        self.header_end += delta
+        self.entries[first:last + 1] = new_entries
+        starts[first:last + 1] = [chunk_start + i for i in parser.starts]
+        if delta:
+            i = first + len(parser.starts)
+            starts[i:] = map(delta.__add__, starts[i:])
+        self.data = data
+        return data
+
+    def latest_entries(self, entries):
+        # Later entries with the same key win, as in a parsed dict. Keys
+        # keep the place of their first entry.
+        return dict(zip(map(_KEY, entries), entries))
+
+    def item_schema(self, key):
+        schema = self.schema
+        if schema is None:
+            return None
+        elif self.root_type is list:
+            return schema.schema
+        return schema.get_item_schema(key)
+
+    def decoded(self, entry):
+        key, value, done = entry
+        if not done:
+            schema = self.item_schema(key)
+            if schema is None:
+                value = freeze(value)
+            else:
+                value = schema.decode_frozen(value)
+            entry[1] = value
+            entry[2] = True
+        return value
+
+    def decode(self, entries, latest=None):
+        try:
+            for entry in entries:
+                self.decoded(entry)
+        except SchemaViolation:
+            if latest is None or self.schema is None or len(entries) < 2:
+                raise
+            # The first violation in the order decode() takes the keys is
+            # reported, keys with a schema of their own go first
+            schemas = list(self.schema.schemas)
+            keys = list(latest)
+
+            def order(entry):
+                key = entry[0]
+                if key in self.schema.schemas:
+                    return (0, schemas.index(key))
+                return (1, keys.index(key))
+
+            for entry in sorted(entries, key=order):
+                self.decoded(entry)
+            raise
+
+    def build(self, latest):
+        data = dict(zip(latest, map(_VALUE, latest.values())))
+        if self.schema is not None:
+            for key, subschema in self.schema.schemas.items():
+                if key not in data:
+                    data[key] = subschema.get_frozen_default()
+        return FrozenDict(data)
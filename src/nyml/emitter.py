@@ -0,0 +1,271 @@
+import time
+
+from .frozen import FrozenDict
+from .records import Record
+from .schema import NymlDictSchema, NymlListSchema
+from .stats import CountingWriter
+
+BUFFER_SIZE = 64 * 1024
+
+# Types written out as dicts
+_MAPPINGS = (dict, Record)
+
+class BufferedWriter:
+    # Collects output fragments and passes them to fp.write() in batches
+    # of about size characters.
+    def __init__(self, fp, size=BUFFER_SIZE):
+        self.fp = fp
+        self.size = size
+        self.parts = []
+        self.pending = 0
+
+    def write(self, s):
+        if len(s) >= self.size:
+            self.flush()
+            self.fp.write(s)
+            return
+        self.parts.append(s)
+        self.pending += len(s)
+        if self.pending >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            self.fp.write(''.join(self.parts))
+            self.parts.clear()
+            self.pending = 0
+
+
+def emit(data, write, schema=None, text_key=None, stats=None):
+    if stats is not None:
+        writer = CountingWriter(write)
+        write = writer.write
+    indent = 0
+
+    def save_type(data, schema=None, collapse=False):
+        if isinstance(data, _MAPPINGS):
+            save_dict(data, schema, collapse)
+        elif isinstance(data, list):
+            save_list(data, schema, collapse)
+        elif data is None:
+            write('\n')
+        else:
+            lines = str(data).split('\n')
+            if lines:
+                if collapse:
+                    write(lines[0])
+                    write('\n')
+                prefix = ' '*indent
+                for line in lines[1 if collapse else 0:]:
+                    write(prefix)
+                    write(line)
+                    write('\n')
+
+    # Keys are checked once
+    valid_keys = set()
+
+    def check_key(key):
+        if key in valid_keys:
+            return
+        strkey = str(key)
+        if strkey.startswith(('-', '+', '>')) \
+                or strkey.find(':') != -1 \
+                or strkey.find('\n') != -1:
+            raise KeyError
+        valid_keys.add(key)
+
+    def save_item(key, value, item_schema):
+        nonlocal indent
+        check_key(key)
+
+        if type(value) is str and value.find('\n') == -1:
+            # The common case of a single line string
+            write(' ' + value + '\n')
+        elif isinstance(value, _MAPPINGS):
+            write('\n')
+            indent += 2
+            save_type(value, item_schema)
+            indent -= 2
+        elif isinstance(value, list):
+            write('\n')
+            save_type(value, item_schema)
+        elif value is None:
+            write('\n')
+        else:
+            indent += 2
+            value = str(value)
+            collapse = True
+            # First line needs to be doubled if it's empty. This will allow
+            # parser to distinguish a string from a dict or list when it's
+            # a dict item.
+            if value and value[0] == '\n':
+                write('\n')
+                collapse = False
+            else:
+                write(' ')
+            save_type(value, item_schema, collapse)
+            indent -= 2
+
+    def save_dict(dct, schema, collapse):
+        if schema is not None and schema.schemas:
+            keys = [k for k in schema.schemas.keys() if k in dct.keys()]
+            keys += [k for k in dct.keys() if k not in schema.schemas]
+        else:
+            keys = list(dct.keys())
+
+        first = collapse
+        for key in keys:
+            if first:
+                write(str(key) + ':')
+                first = False
+            else:
+                write(' '*indent + str(key) + ':')
+            save_item(key, dct[key],
+                      None if schema is None else schema.get_item_schema(key))
+
+    # The encode_ functions write what save_type() writes for data encoded
+    # by schema.encode(), without building the encoded copy. Values which
+    # schema.encode() leaves out as defaults are skipped on the way.
+
+    def is_default(value, schema):
+        if not isinstance(schema, NymlDictSchema):
+            return not value != schema.default
+        if schema.default or not isinstance(value, _MAPPINGS):
+            return not schema.reduce(value) != schema.default
+        # The value reduces to an empty dict if all its items are defaults
+        for key in value:
+            item_schema = schema.get_item_schema(key)
+            if item_schema is None or not is_default(value[key], item_schema):
+                return False
+        return True
+
+    def encode_dict(dct, schema, collapse):
+        nonlocal indent
+        schemas = schema.schemas
+        common = schema.schema
+        if schemas:
+            keys = [k for k in schemas if k in dct]
+            keys += [k for k in dct if k not in schemas]
+        else:
+            keys = dct
+
+        first = collapse
+        for key in keys:
+            value = dct[key]
+            item_schema = schemas.get(key, common)
+            if item_schema is not None:
+                if isinstance(item_schema, NymlDictSchema):
+                    if is_default(value, item_schema):
+                        continue
+                elif not value != item_schema.default:
+                    continue
+
+            if first:
+                write(str(key) + ':')
+                first = False
+            else:
+                write(' '*indent + str(key) + ':')
+
+            if item_schema is None:
+                save_item(key, value, None)
+            elif isinstance(item_schema, NymlDictSchema) \
+                    and isinstance(value, _MAPPINGS):
+                check_key(key)
+                write('\n')
+                indent += 2
+                encode_dict(value, item_schema, False)
+                indent -= 2
+            elif isinstance(item_schema, NymlListSchema) \
+                    and isinstance(value, list):
+                check_key(key)
+                write('\n')
+                encode_list(value, item_schema, False)
+            else:
+                save_item(key, item_schema.encode(value), item_schema)
+
+    def encode_list(lst, schema, collapse):
+        nonlocal indent
+        item_schema = schema.schema
+        if item_schema is None:
+            save_list(lst, schema, collapse)
+            return
+
+        first = collapse
+        for item in lst:
+            if isinstance(item_schema, NymlDictSchema) \
+                    and isinstance(item, _MAPPINGS):
+                encode = encode_dict
+            elif isinstance(item_schema, NymlListSchema) \
+                    and isinstance(item, list):
+                encode = encode_list
+            else:
+                encode = None
+                item = item_schema.encode(item)
+
+            mark = marker(item) if encode is None else '+ '
+            if first:
+                write(mark)
+                first = False
+            else:
+                write(' '*indent + mark)
+
+            indent += 2
+            if encode is None:
+                save_type(item, item_schema, collapse=True)
+            else:
+                encode(item, item_schema, True)
+            indent -= 2
+
+    def marker(item):
+        if isinstance(item, list) or isinstance(item, _MAPPINGS):
+            return '+ '
+        else:
+            return '- '
+
+    def save_list(lst, schema, collapse):
+        nonlocal indent
+        item_schema = schema.get_item_schema() if schema is not None else None
+
+        first = collapse
+        for item in lst:
+            if first:
+                write(marker(item))
+                first = False
+            else:
+                write(' '*indent + marker(item))
+            indent += 2
+            save_type(item, item_schema, collapse=True)
+            indent -= 2
+
+    if data is not None and data != '':
+        text = None
+        if text_key is not None and isinstance(data, _MAPPINGS):
+            if isinstance(data, (FrozenDict, Record)):
+                data = dict(data)
+            text = data.pop(text_key, None)
+
+        if stats is not None:
+            start = time.perf_counter()
+
+        if isinstance(schema, NymlDictSchema) \
+                and isinstance(data, _MAPPINGS):
+            encode_dict(data, schema, False)
+        elif isinstance(schema, NymlListSchema) and isinstance(data, list):
+            encode_list(data, schema, False)
+        else:
+            if schema is not None:
+                data = schema.encode(data)
+
+            if stats is not None:
+                stats.add_time('encode', time.perf_counter() - start)
+                start = time.perf_counter()
+
+            save_type(data, schema, collapse=False)
+
+        if text:
+            write('\n')
+            write(str(text).replace('\r\n', '\n'))
+
+        if stats is not None:
+            stats.add_time('emit', time.perf_counter() - start)
+            stats.add(output_chars=writer.chars)
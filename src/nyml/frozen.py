@@ -0,0 +1,56 @@
+def _immutable(self, *args, **kwargs):
+    raise TypeError(f'{type(self).__name__} is immutable')
+
+
+class FrozenDict(dict):
+    # A dict that cannot be modified after it is made. Being a dict, it
+    # goes everywhere a decoded dict goes. Copies are not needed, so copy()
+    # and deepcopy() return the object itself.
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+    __ior__ = _immutable
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+    def __repr__(self):
+        return f'FrozenDict({dict.__repr__(self)})'
+
+
+class FrozenList(list):
+    __slots__ = ()
+
+    __setitem__ = __delitem__ = _immutable
+    append = extend = insert = pop = remove = _immutable
+    reverse = sort = clear = _immutable
+    __iadd__ = __imul__ = _immutable
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (type(self), (list(self),))
+
+    def __repr__(self):
+        return f'FrozenList({list.__repr__(self)})'
+
+
+def freeze(value):
+    if isinstance(value, (FrozenDict, FrozenList)):
+        return value
+    elif isinstance(value, dict):
+        return FrozenDict((key, freeze(v)) for key, v in value.items())
+    elif isinstance(value, list):
+        return FrozenList(freeze(v) for v in value)
+    return value
@@ -0,0 +1,107 @@
+import collections.abc
+
+from .schema import NymlDictSchema, NymlListSchema
+
+def lazy_decode(entry, schema):
+    # Containers matching their schema are wrapped, everything else is
+    # decoded right away.
+    if isinstance(entry, dict) and isinstance(schema, NymlDictSchema):
+        return LazyDict(entry, schema)
+    elif isinstance(entry, list) and isinstance(schema, NymlListSchema) \
+            and schema.schema is not None:
+        return LazyList(entry, schema)
+    elif schema is None:
+        return entry
+    return schema.decode(entry)
+
+def materialize(value):
+    if isinstance(value, (LazyDict, LazyList)):
+        return value.materialize()
+    return value
+
+
+class LazyDict(collections.abc.Mapping):
+    # Read-only view of a parsed dict. Values are decoded, and defaults of
+    # missing keys made, the first time they are read. Keys come in the
+    # order of the parsed dict followed by the missing keys of the schema.
+    __slots__ = ('raw', 'schema', 'decoded')
+
+    def __init__(self, raw, schema):
+        self.raw = raw
+        self.schema = schema
+        self.decoded = {}
+
+    def __getitem__(self, key):
+        try:
+            return self.decoded[key]
+        except KeyError:
+            pass
+
+        schema = self.schema
+        if key in self.raw:
+            value = lazy_decode(self.raw[key], schema.get_item_schema(key))
+        elif key in schema.schemas:
+            value = schema.schemas[key].get_default()
+        else:
+            raise KeyError(key)
+        self.decoded[key] = value
+        return value
+
+    def __contains__(self, key):
+        return key in self.raw or key in self.schema.schemas
+
+    def __iter__(self):
+        raw = self.raw
+        yield from raw
+        for key in self.schema.schemas:
+            if key not in raw:
+                yield key
+
+    def __len__(self):
+        raw = self.raw
+        return len(raw) + sum(1 for key in self.schema.schemas
+                              if key not in raw)
+
+    def __repr__(self):
+        return f'LazyDict({self.materialize()!r})'
+
+    def materialize(self):
+        return {key: materialize(self[key]) for key in self}
+
+
+class LazyList(collections.abc.Sequence):
+    # Read-only view of a parsed list, items are decoded when first read
+    __slots__ = ('raw', 'schema', 'decoded')
+
+    _missing = object()
+
+    def __init__(self, raw, schema):
+        self.raw = raw
+        self.schema = schema
+        self.decoded = [self._missing] * len(raw)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self.raw)))]
+
+        value = self.decoded[index]
+        if value is self._missing:
+            value = lazy_decode(self.raw[index], self.schema.schema)
+            self.decoded[index] = value
+        return value
+
+    def __len__(self):
+        return len(self.raw)
+
+    def __eq__(self, other):
+        if not isinstance(other, collections.abc.Sequence) \
+                or isinstance(other, str):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b
+                                               for a, b in zip(self, other))
+
+    def __repr__(self):
+        return f'LazyList({self.materialize()!r})'
+
+    def materialize(self):
+        return [materialize(value) for value in self]
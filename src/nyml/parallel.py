@@ -0,0 +1,138 @@
+import collections
+import concurrent.futures
+import io
+import itertools
+import mmap
+import os
+import re
+
+from .exceptions import *
+
+# Per worker process state, set up once by the pool initializer
+_schema = None
+_text_key = None
+_map = None
+_encoding = None
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# A line break followed by a blank line
+_BLANK_LINE = re.compile(rb'\n\r?\n')
+
+def _init_worker(schema, text_key):
+    global _schema, _text_key
+    _schema = schema
+    _text_key = text_key
+
+def _load_paths(paths):
+    from . import load_file
+
+    results = []
+    for path in paths:
+        try:
+            results.append((path, load_file(path, _schema, _text_key)))
+        except (NymlError, OSError, UnicodeDecodeError) as e:
+            results.append((path, e))
+    return results
+
+def _init_stream_worker(path, schema, encoding):
+    global _schema, _map, _encoding
+    _schema = schema
+    _encoding = encoding
+    with open(path, 'rb') as fp:
+        _map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _load_range(span):
+    return _decode_range(_map, span, _schema, _encoding)
+
+def _decode_range(data, span, schema, encoding):
+    from . import load_all
+
+    start, end = span
+    text = data[start:end].decode(encoding)
+    return list(load_all(io.StringIO(text, newline=None), schema))
+
+def _ranges(data, size):
+    # Byte ranges of about size bytes, each ending just past a blank line
+    # and so at the start of a document.
+    start = 0
+    while start < len(data):
+        match = _BLANK_LINE.search(data, max(start + size - 1, start))
+        end = match.end() if match else len(data)
+        yield start, end
+        start = end
+
+def _chunks(iterable, size):
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+def load_many(paths, schema=None, text_key=None, workers=None, chunksize=32,
+              ordered=True):
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers == 1:
+        _init_worker(schema, text_key)
+        for chunk in _chunks(paths, chunksize):
+            yield from _load_paths(chunk)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(workers,
+            initializer=_init_worker,
+            initargs=(schema, text_key)) as pool:
+        # Keep only a couple of chunks per worker in flight so that paths
+        # and results are not queued up all at once.
+        yield from _submit(pool, _load_paths, _chunks(paths, chunksize),
+                           2 * workers, ordered)
+
+def _submit(pool, fn, chunks, window, ordered):
+    # Yields the items of fn(chunk) for every chunk with at most window
+    # chunks in flight
+    pending = collections.deque(pool.submit(fn, chunk)
+            for chunk in itertools.islice(chunks, window))
+
+    while pending:
+        if ordered:
+            done = [pending.popleft()]
+        else:
+            done, _ = concurrent.futures.wait(pending,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                pending.remove(future)
+
+        for future in done:
+            for chunk in itertools.islice(chunks, 1):
+                pending.append(pool.submit(fn, chunk))
+            yield from future.result()
+
+def load_all_file(path, schema=None, workers=None, chunk_size=CHUNK_SIZE,
+                  prefetch=None, encoding='utf-8'):
+    # Parallel load_all() of a file. The file is split into ranges of about
+    # chunk_size bytes at blank lines, which workers map and parse on their
+    # own. At most prefetch ranges are parsed ahead of the records yielded.
+    # The encoding has to keep line breaks single bytes, as UTF-8 does.
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if prefetch is None:
+        prefetch = 2 * workers
+
+    with open(path, 'rb') as fp:
+        if not os.fstat(fp.fileno()).st_size:
+            return
+        data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+    with data:
+        ranges = _ranges(data, chunk_size)
+        if workers == 1:
+            for span in ranges:
+                yield from _decode_range(data, span, schema, encoding)
+            return
+
+        with concurrent.futures.ProcessPoolExecutor(workers,
+                initializer=_init_stream_worker,
+                initargs=(path, schema, encoding)) as pool:
+            yield from _submit(pool, _load_range, ranges, prefetch, True)
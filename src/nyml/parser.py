@@ -0,0 +1,293 @@
+import codecs
+
+from .exceptions import *
+from .frozen import freeze
+from .lazy import lazy_decode
+
+class _Text:
+    # Multiline string under construction. Lines are collected and joined
+    # once when the string is complete.
+    __slots__ = ('lines',)
+
+    def __init__(self, first, second):
+        self.lines = [first, second]
+
+    def __str__(self):
+        return '\n'.join(self.lines)
+
+
+class Parser:
+    def __init__(self):
+        self.indent = 0
+        self.stack = []
+        self.element = None
+        self.lineno = 0
+
+    def feed(self, line):
+        self.lineno += 1
+
+        indent = self.indent
+        next_indent = indent + 2
+        no_indent_line = line.lstrip()
+        line_indent = len(line) - len(no_indent_line)
+
+        if line_indent > next_indent:
+            no_indent_line = ' '*(line_indent - next_indent) + no_indent_line
+            line_indent = next_indent
+        elif line_indent > indent:
+            no_indent_line = ' '*(line_indent - indent) + no_indent_line
+            line_indent = indent
+
+        if line_indent < indent or isinstance(self.element, list):
+            self.finish_element(line_indent, no_indent_line)
+
+        try:
+            self.parse_line(no_indent_line)
+        except ParseError as e:
+            raise ParseError(f'{e} at line {self.lineno}: {line}')
+
+    def close(self):
+        self.finish_element(0, '')
+        element = self.element
+        if type(element) is _Text:
+            element = str(element)
+        return element
+
+    def new_dict(self):
+        return {}
+
+    def new_list(self):
+        return []
+
+    def attach(self, parent, key, element):
+        if type(element) is _Text:
+            element = str(element)
+        if key is None:
+            parent.append(element)
+        else:
+            parent[key] = element
+
+    def finish_element(self, new_indent, line):
+        indent = self.indent
+        element = self.element
+        stack = self.stack
+
+        # Stack frames are (indent, container, key) where key is None
+        # for list items.
+        while new_indent < indent:
+            frame_indent, parent, key = stack[-1]
+            if key is not None and new_indent == frame_indent \
+                    and line and line[0] in '-+' and element is None:
+                self.indent = new_indent
+                self.element = element
+                return
+            stack.pop()
+            self.attach(parent, key, element)
+            indent = frame_indent
+            element = parent
+
+        if isinstance(element, list) and (not line or line[0] not in '-+') \
+                and stack:
+            indent, parent, key = stack.pop()
+            self.attach(parent, key, element)
+            element = parent
+
+        self.indent = indent
+        self.element = element
+
+    def parse_line(self, line):
+        element = self.element
+        pos = 0
+
+        # Chains of '+' markers are consumed in place rather than by
+        # slicing the line once per marker.
+        while True:
+            if isinstance(element, str):
+                element = _Text(element, line[pos:] if pos else line)
+                break
+            elif type(element) is _Text:
+                element.lines.append(line[pos:] if pos else line)
+                break
+
+            marker = line[pos:pos + 1]
+            if marker and marker in '-+':
+                if element is None:
+                    element = self.new_list()
+                elif not isinstance(element, list):
+                    raise ParseError('unexpected list')
+                self.stack.append((self.indent, element, None))
+                self.indent += 2
+                pos += 2 if line[pos + 1:pos + 2] == ' ' else 1
+                if marker == '-':
+                    element = line[pos:]
+                    break
+                element = None
+                continue
+
+            if pos:
+                line = line[pos:]
+            parts = line.split(':', 1)
+            if len(parts) == 1:
+                if element is None:
+                    element = line
+                else:
+                    raise ParseError('unexpected string')
+            else:
+                if element is None:
+                    element = self.new_dict()
+                elif not isinstance(element, dict):
+                    raise ParseError('unexpected dict')
+
+                key, value = parts
+                if value and value[0] == ' ':
+                    value = value[1:]
+                if not value:
+                    value = None
+
+                self.stack.append((self.indent, element, key))
+                self.indent += 2
+                element = value
+            break
+
+        self.element = element
+
+
+class EventParser(Parser):
+    # Containers passed around by the base parser are never filled here,
+    # they only carry the type of the element. Everything else is reported
+    # as (event, value) tuples collected in self.events.
+    def __init__(self):
+        super().__init__()
+        self.events = []
+
+    def close(self):
+        self.finish_element(0, '')
+        if self.element is not None:
+            self.attach(None, None, self.element)
+        self.element = None
+
+    def start_item(self):
+        # A key is reported when its value starts, or together with the
+        # value if the latter is a scalar.
+        if self.stack:
+            key = self.stack[-1][2]
+            if key is not None:
+                self.events.append(('key', key))
+
+    def new_dict(self):
+        self.start_item()
+        self.events.append(('start_dict', None))
+        return {}
+
+    def new_list(self):
+        self.start_item()
+        self.events.append(('start_list', None))
+        return []
+
+    def attach(self, parent, key, element):
+        if isinstance(element, (dict, list)):
+            self.events.append(('end', None))
+        else:
+            if key is not None:
+                self.events.append(('key', key))
+            if type(element) is _Text:
+                element = str(element)
+            self.events.append(('scalar', element))
+
+
+class IncrementalLoader:
+    def __init__(self, schema=None, text_key=None, encoding=None):
+        self.schema = schema
+        self.text_key = text_key
+        self._decoder = codecs.getincrementaldecoder(encoding)() \
+                if encoding is not None \
+                else None
+        self._parser = Parser()
+        self._pending = []
+        # Becomes a list once the blank line ending the header has been seen
+        self._body = None
+
+    @property
+    def done(self):
+        # True once the rest of the input would be ignored
+        return self._body is not None and self.text_key is None
+
+    def feed(self, chunk):
+        if self._decoder is not None:
+            chunk = self._decoder.decode(chunk)
+        self._feed(chunk)
+
+    def _feed(self, chunk):
+        if self._body is not None:
+            if self.text_key is not None:
+                self._body.append(chunk)
+            return
+
+        end = chunk.find('\n')
+        if end == -1:
+            if chunk:
+                self._pending.append(chunk)
+            return
+
+        if self._pending:
+            self._pending.append(chunk[:end])
+            line = ''.join(self._pending)
+        else:
+            line = chunk[:end]
+
+        parser = self._parser
+        start = end + 1
+        while line:
+            parser.feed(line)
+            end = chunk.find('\n', start)
+            if end == -1:
+                self._pending = [chunk[start:]] if start < len(chunk) else []
+                return
+            line = chunk[start:end]
+            start = end + 1
+
+        self._pending = []
+        self._body = []
+        if self.text_key is not None and start < len(chunk):
+            self._body.append(chunk[start:])
+
+    def close(self):
+        if self._decoder is not None:
+            self._feed(self._decoder.decode(b'', True))
+
+        if self._body is None:
+            line = ''.join(self._pending)
+            if line:
+                self._parser.feed(line)
+            body = ''
+        else:
+            body = ''.join(self._body)
+
+        element = self._parser.close()
+
+        if self.text_key is not None:
+            element[self.text_key] = body
+
+        return apply_schema(element, self.schema)
+
+
+def apply_schema(element, schema, lazy=False, frozen=False, records=False,
+                 stats=None):
+    if records and schema is not None:
+        if element is None:
+            return schema.get_record_default()
+        return schema.decode_records(element)
+    elif frozen:
+        if schema is None:
+            return freeze(element)
+        elif element is None:
+            return schema.get_frozen_default()
+        return schema.decode_frozen(element)
+    elif schema is None:
+        return element
+    elif element is None:
+        return schema.get_default()
+    elif lazy:
+        return lazy_decode(element, schema)
+    else:
+        return schema.decode(element, stats)
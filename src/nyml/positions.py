@@ -0,0 +1,128 @@
+import bisect
+
+from .exceptions import *
+from .parser import Parser
+from .schema import NymlDictSchema, NymlListSchema
+
+class PositionIndex:
+    # Positions of dict values and list items by path, a tuple of keys and
+    # list indices. Every position is (line number, byte offset of the line
+    # the element starts at, byte offset past its last line, indentation of
+    # its key or list marker).
+    def __init__(self):
+        self.positions = {}
+
+    def __contains__(self, path):
+        return self.normalize(path) in self.positions
+
+    def __getitem__(self, path):
+        return self.positions[self.normalize(path)]
+
+    def __len__(self):
+        return len(self.positions)
+
+    def normalize(self, path):
+        # 'a/0/b' is the same as ('a', 0, 'b') if a is a list, and as
+        # ('a', '0', 'b') if it is a dict. Segments are taken as keys first,
+        # a list has no string keys to find.
+        if not isinstance(path, str):
+            return tuple(path)
+        positions = self.positions
+        result = ()
+        for key in path.split('/'):
+            if key.isdecimal() and result + (key,) not in positions:
+                key = int(key)
+            result += (key,)
+        return result
+
+    def line(self, path):
+        return self[path][0]
+
+
+class _Frames(list):
+    # Parser stack that records the element of every frame pushed to it
+    def __init__(self, parser):
+        super().__init__()
+        self.parser = parser
+        self.records = []
+
+    def append(self, frame):
+        indent, container, key = frame
+        self.records.append((self.parser.lineno, indent, len(self),
+                             len(container) if key is None else key))
+        list.append(self, frame)
+
+
+class IndexingParser(Parser):
+    # Elements are recorded as (line number, indentation, depth, key or list
+    # index) in document order while parsing. resolve() turns them into
+    # positions by path once the header has been read.
+    def __init__(self, index):
+        super().__init__()
+        self.positions = index.positions
+        self.stack = _Frames(self)
+
+    def resolve(self, offsets):
+        # offsets[n] is the byte offset of line n, the last one that of the
+        # end of the header. Every element ends where the next one at the
+        # same depth or above starts.
+        positions = self.positions
+        records = self.stack.records
+        # Path of every record so far
+        paths = []
+        # (path, position) of every element still open, below the root
+        stack = [((), None)]
+        for lineno, indent, depth, key in records:
+            start = offsets[lineno]
+            while len(stack) > depth + 1:
+                stack.pop()[1][2] = start
+            path = stack[-1][0] + (key,)
+            if path in positions:
+                # A later value for the key replaces the earlier one, and
+                # everything below it with it
+                i = bisect.bisect_left(records, (positions[path][0],))
+                while paths[i] != path:
+                    i += 1
+                for i in range(i + 1, len(paths)):
+                    if paths[i][:depth + 1] != path:
+                        break
+                    positions.pop(paths[i], None)
+            position = positions[path] = [lineno, start, None, indent]
+            paths.append(path)
+            stack.append((path, position))
+        for _, position in stack[1:]:
+            position[2] = offsets[-1]
+
+
+def iter_violations(element, schema, path=()):
+    # Yields (path, error) for the values schema.decode() rejects. This
+    # works on partly decoded trees as well, decoded values pass again.
+    if schema is None:
+        return
+    if isinstance(schema, NymlDictSchema):
+        if element is None:
+            return
+        if isinstance(element, dict):
+            for key, value in element.items():
+                yield from iter_violations(value, schema.get_item_schema(key),
+                                           path + (key,))
+            return
+    elif isinstance(schema, NymlListSchema):
+        if element is None:
+            return
+        if isinstance(element, list):
+            for i, value in enumerate(element):
+                yield from iter_violations(value, schema.schema, path + (i,))
+            return
+
+    try:
+        schema.decode(element)
+    except SchemaViolation as e:
+        yield path, e
+
+def locate_violation(element, schema, error, index):
+    # Returns the path and line of the value that caused error
+    for path, e in iter_violations(element, schema):
+        if str(e) == str(error) and path in index.positions:
+            return path, index.positions[path][0]
+    return None, None
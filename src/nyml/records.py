@@ -0,0 +1,71 @@
+import collections.abc
+import keyword
+
+class Record(collections.abc.Mapping):
+    # Base of the classes made by make_record_class(). Keys of the schema
+    # are kept in slots, any other keys in the _extra dict. Records iterate
+    # in schema order followed by the other keys.
+    __slots__ = ('_extra',)
+
+    _keys = ()
+    _names = {}
+
+    def __getitem__(self, key):
+        name = self._names.get(key)
+        if name is not None:
+            return getattr(self, name)
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        name = self._names.get(key)
+        if name is not None:
+            setattr(self, name, value)
+        elif self._extra is None:
+            self._extra = {key: value}
+        else:
+            self._extra[key] = value
+
+    def __contains__(self, key):
+        return key in self._names or (self._extra is not None
+                                      and key in self._extra)
+
+    def __iter__(self):
+        yield from self._keys
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self):
+        if self._extra is None:
+            return len(self._keys)
+        return len(self._keys) + len(self._extra)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self.items())!r})'
+
+
+def _attribute_name(key, index):
+    # Keys that are no identifiers or would hide something are stored under
+    # a made up name and are only reachable by item access.
+    if key.isidentifier() and not keyword.iskeyword(key) \
+            and not key.startswith('_') and not hasattr(Record, key):
+        return key
+    return f'_field{index}'
+
+def make_record_class(keys, name='Record'):
+    keys = tuple(keys)
+    names = [_attribute_name(key, i) for i, key in enumerate(keys)]
+
+    # The constructor takes the values in schema order
+    args = ''.join(f'{n}, ' for n in names)
+    lines = [f'def __init__(self, {args}_extra=None):']
+    lines += [f'    self.{n} = {n}' for n in names]
+    lines.append('    self._extra = _extra')
+    namespace = {}
+    exec('\n'.join(lines), namespace)
+
+    return type(name, (Record,), {'__slots__': tuple(names),
+                                  '__init__': namespace['__init__'],
+                                  '_keys': keys,
+                                  '_names': dict(zip(keys, names))})
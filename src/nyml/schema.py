@@ -1,20 +1,240 @@
+import collections
 import copy
+import os
+import threading
 
 from .exceptions import *
+from .frozen import FrozenDict, FrozenList, freeze
+from .records import Record, make_record_class
+
+# Nested schemas deeper than this are compiled into separate functions
+# rather than inlined, to stay clear of the compiler's block nesting limit.
+COMPILE_DEPTH = 4
+
+def _bind(namespace, prefix, value):
+    name = f'{prefix}{len(namespace)}'
+    namespace[name] = value
+    return name
+
+def _indent(lines):
+    return ['    ' + line for line in lines]
+
+def _wrong_type(src, typename):
+    return [f"    raise SchemaViolation(f'wrong type of {{{src}}}'",
+            f"            f' (expected {typename},"
+            f" got {{type({src}).__name__}})')"]
+
+
+# Compiled dumpers raise this for values they have no code for, the whole
+# document is then written by emit() instead.
+class _Fallback(Exception):
+    pass
+
+_MISSING = object()
+
+def _dump_namespace():
+    return {'_Fallback': _Fallback, 'MISSING': _MISSING,
+            'MAPPINGS': (dict, Record)}
+
+def _valid_key(key):
+    strkey = str(key)
+    return not (strkey.startswith(('-', '+', '>')) or ':' in strkey
+                or '\n' in strkey)
+
+def _dump_str(src, sp, nl):
+    return [f"if {src}.__class__ is str and {src}.find('\\n') == -1:",
+            f"    write({sp} + {src} + '\\n')",
+            f'elif {src} is None:',
+            f'    write({nl})',
+            'else:',
+            '    raise _Fallback']
+
+def _dump_entry(src, schema, sp, nl, indent, namespace, depth):
+    # A dict item, left out if schema.encode() would leave it out
+    if schema is None:
+        return _dump_str(src, sp, nl)
+
+    guard = schema.compile_dump_guard(src)
+    if guard is None:
+        lines = schema.compile_dump_value(src, sp, nl, namespace, depth)
+    else:
+        # Dicts go one level deeper, lists stay at the indentation of the key
+        if isinstance(schema, NymlDictSchema):
+            indent += '  '
+        lines = ([f'if {guard}:',
+                  '    raise _Fallback',
+                  f'write({nl})'] +
+                 schema.compile_dump_body(src, indent, namespace, depth + 1))
+
+    if isinstance(schema, NymlDictSchema) and not schema.default:
+        # The item is left out if nothing of it was written
+        mark = f'm{depth}'
+        return ([f'{mark} = len(out)'] + lines +
+                [f'if len(out) == {mark} + 1:',
+                 f'    del out[{mark}]'])
+
+    if isinstance(schema, NymlDictSchema):
+        reduce = _bind(namespace, 'reduce', schema.reduce)
+        condition = f'{reduce}({src}) != '
+    else:
+        condition = f'{src} != '
+    condition += _bind(namespace, 'default', schema.default)
+    return [f'if {condition}:'] + _indent(lines)
+
+def _dump_item(src, schema, indent, namespace, depth):
+    # A list item
+    sp = repr(indent + '- ')
+    nl = repr(indent + '- \n')
+    if schema is None:
+        return _dump_str(src, sp, nl)
+
+    guard = schema.compile_dump_guard(src)
+    if guard is None:
+        return schema.compile_dump_value(src, sp, nl, namespace, depth)
+
+    # The container starts on the line of its '+' marker, which takes the
+    # place of the indentation of its first line.
+    mark = f'm{depth}'
+    marker = repr(indent + '+ ')
+    return ([f'if {guard}:',
+             '    raise _Fallback',
+             f'{mark} = len(out)'] +
+            schema.compile_dump_body(src, indent + '  ', namespace, depth + 1) +
+            [f'if len(out) == {mark}:',
+             f'    write({marker})',
+             'else:',
+             f'    out[{mark}] = {marker} + out[{mark}][{len(indent) + 2}:]'])
+
+def _dump_function(schema, indent):
+    namespace = _dump_namespace()
+    lines = ['def dump(src, out):',
+             '    write = out.append']
+    lines += _indent(schema.compile_dump_body('src', indent, namespace, 0))
+    exec('\n'.join(lines), namespace)
+    return namespace['dump']
+
 
 class NymlSchema:
+    # Attributes made from the schema on demand, they are left out when the
+    # schema is pickled and made again after
+    _CACHED = ('_decoder', '_record_class')
+
     def __init__(self, definition):
         self.default = definition.get('default')
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for attr in self._CACHED:
+            state.pop(attr, None)
+        return state
+
     def get_default(self):
         return self.default
 
-    def decode(self, entry):
+    def fingerprint(self):
+        # Equal fingerprints mean the schemas decode everything the same way
+        return (type(self).__name__, self.default)
+
+    def get_frozen_default(self):
+        return freeze(self.get_default())
+
+    def decode(self, entry, stats=None):
         pass
 
+    def decode_frozen(self, entry):
+        # Like decode(), but containers come out as FrozenDict and FrozenList
+        # and defaults are shared rather than copied. Scalar schemas can
+        # let containers through, str does, so these are frozen as well.
+        return freeze(self.decode(entry))
+
+    def get_record_default(self):
+        return self.get_default()
+
+    def decode_records(self, entry):
+        # Like decode(), but dicts with per element schemas come out as
+        # instances of a record class made for the schema.
+        return self.decode(entry)
+
     def encode(self, entry):
         pass
 
+    def compile(self):
+        namespace = {'SchemaViolation': SchemaViolation}
+        lines = ['def decode(entry):']
+        lines += _indent(self.compile_decode('entry', 'entry', namespace, 0))
+        lines.append('    return entry')
+        exec('\n'.join(lines), namespace)
+        return namespace['decode']
+
+    def get_decoder(self):
+        # The compiled decoder is cached, schemas do not change once made
+        decoder = self.__dict__.get('_decoder')
+        if decoder is None:
+            decoder = self._decoder = self.compile()
+        return decoder
+
+    # The compile_* methods return lines of Python code. compile_decode()
+    # decodes the value of the local variable src and stores the result to
+    # dst, which is either src itself or the place src was read from.
+    def compile_decode(self, src, dst, namespace, depth):
+        decode = _bind(namespace, 'decode', self.decode)
+        return [f'{dst} = {decode}({src})']
+
+    def compile_default(self, dst, namespace, depth):
+        default = _bind(namespace, 'default', self.default)
+        return [f'{dst} = {default}']
+
+    def compile_dumper(self):
+        # Returns a function that works as dumps(data, schema) with the key
+        # lines and indentation of this schema written out in its code.
+        from .emitter import emit
+
+        def fallback(data):
+            parts = []
+            emit(data, parts.append, self)
+            return ''.join(parts)
+
+        guard = self.compile_dump_guard('data')
+        if guard is None:
+            return fallback
+
+        namespace = _dump_namespace()
+        namespace['fallback'] = fallback
+        lines = ['def dumps(data):',
+                 f'    if {guard}:',
+                 '        return fallback(data)',
+                 '    out = []',
+                 '    write = out.append',
+                 '    try:']
+        lines += _indent(_indent(self.compile_dump_body('data', '', namespace,
+                                                        0)))
+        lines += ['    except _Fallback:',
+                  '        return fallback(data)',
+                  "    return ''.join(out)"]
+        exec('\n'.join(lines), namespace)
+        return namespace['dumps']
+
+    # The compile_dump_* methods return lines of code that append the text
+    # of src to the list out through write(). compile_dump_value() writes a
+    # scalar after the code sp evaluates to, or after nl if it takes a line
+    # of its own. compile_dump_body() writes the items of a container at
+    # indentation indent, and compile_dump_guard() is the condition under
+    # which src is no such container.
+    def compile_dump_value(self, src, sp, nl, namespace, depth):
+        return ['raise _Fallback']
+
+    def compile_dump_guard(self, src):
+        return None
+
+    def compile_items(self, src, dst, namespace, depth):
+        item = f'v{depth}'
+        items = f'items{depth}'
+        return ([f'{items} = []',
+                 f'for {item} in {src}:'] +
+                _indent(self.compile_decode(item, item, namespace, depth + 1)) +
+                [f'    {items}.append({item})',
+                 f'{dst} = {items}'])
+
 
 class NymlStrSchema(NymlSchema):
     def __init__(self, definition):
@@ -26,12 +246,22 @@ class NymlStrSchema(NymlSchema):
             raise SchemaError('type mismatch in default value'
                     f' (expected string, got {type(self.default).__name__})')
 
-    def decode(self, entry):
+    def decode(self, entry, stats=None):
         return '' if entry is None else entry
 
     def encode(self, entry):
         return entry
 
+    def compile_decode(self, src, dst, namespace, depth):
+        return [f'if {src} is None:',
+                f"    {dst} = ''"]
+
+    def compile_items(self, src, dst, namespace, depth):
+        return [f"{dst} = ['' if v is None else v for v in {src}]"]
+
+    def compile_dump_value(self, src, sp, nl, namespace, depth):
+        return _dump_str(src, sp, nl)
+
 
 class NymlIntSchema(NymlSchema):
     def __init__(self, definition):
@@ -45,7 +275,7 @@ class NymlIntSchema(NymlSchema):
             except:
                 raise SchemaError('type mismatch in default value')
 
-    def decode(self, entry):
+    def decode(self, entry, stats=None):
         try:
             return int(entry)
         except:
@@ -54,6 +284,32 @@ class NymlIntSchema(NymlSchema):
     def encode(self, entry):
         return str(entry)
 
+    def compile_decode(self, src, dst, namespace, depth):
+        return ['try:',
+                f'    {dst} = int({src})',
+                'except:',
+                f"    raise SchemaViolation(f'invalid integer value: {{{src}}}')"]
+
+    def compile_items(self, src, dst, namespace, depth):
+        # Convert the whole list at once and look for the offending item
+        # only if that fails.
+        return ['try:',
+                f'    {dst} = [int(v) for v in {src}]',
+                'except:',
+                f'    for v in {src}:',
+                '        try:',
+                '            int(v)',
+                '        except:',
+                "            raise SchemaViolation(f'invalid integer value: {v}')",
+                '    raise']
+
+    def compile_dump_value(self, src, sp, nl, namespace, depth):
+        text = f's{depth}'
+        return [f'{text} = str({src})',
+                f"if {text}.find('\\n') != -1:",
+                '    raise _Fallback',
+                f"write({sp} + {text} + '\\n')"]
+
 
 class NymlBoolSchema(NymlSchema):
     def __init__(self, definition):
@@ -67,19 +323,28 @@ class NymlBoolSchema(NymlSchema):
             raise SchemaError('type mismatch in default value'
                     f' (expected bool, got {type(self.default).__name__})')
 
-    def decode(self, entry):
+    def decode(self, entry, stats=None):
         return entry in ('yes', 'true', '1', 'on')
 
     def encode(self, entry):
         return 'yes' if entry else 'no'
 
+    def compile_decode(self, src, dst, namespace, depth):
+        return [f"{dst} = {src} in ('yes', 'true', '1', 'on')"]
+
+    def compile_items(self, src, dst, namespace, depth):
+        return [f"{dst} = [v in ('yes', 'true', '1', 'on') for v in {src}]"]
+
+    def compile_dump_value(self, src, sp, nl, namespace, depth):
+        return [f"write({sp} + ('yes\\n' if {src} else 'no\\n'))"]
+
 
 class NymlListSchema(NymlSchema):
-    def __init__(self, definition):
+    def __init__(self, definition, cache=None):
         super().__init__(definition)
 
         if 'schema' in definition:
-            self.schema = make_schema(definition['schema'])
+            self.schema = make_schema(definition['schema'], cache)
         else:
             self.schema = None
 
@@ -92,10 +357,20 @@ class NymlListSchema(NymlSchema):
     def get_item_schema(self):
         return self.schema
 
+    def fingerprint(self):
+        return super().fingerprint() + (
+                None if self.schema is None else self.schema.fingerprint(),)
+
     def get_default(self):
         return copy.deepcopy(self.default)
 
-    def decode(self, entry):
+    def get_frozen_default(self):
+        default = self.__dict__.get('_frozen_default')
+        if default is None:
+            default = self._frozen_default = freeze(self.default)
+        return default
+
+    def decode(self, entry, stats=None):
         if entry is None:
             return []
         elif not isinstance(entry, list):
@@ -103,7 +378,31 @@ class NymlListSchema(NymlSchema):
                     f' (expected list, got {type(entry).__name__})')
         elif self.schema is not None:
             # Common schema for all elements
-            return [self.schema.decode(v) for v in entry]
+            return [self.schema.decode(v, stats) for v in entry]
+        else:
+            return entry
+
+    def decode_frozen(self, entry):
+        if entry is None:
+            return FrozenList()
+        elif not isinstance(entry, list):
+            raise SchemaViolation(f'wrong type of {entry}'
+                    f' (expected list, got {type(entry).__name__})')
+        elif self.schema is not None:
+            decode = self.schema.decode_frozen
+            return FrozenList([decode(v) for v in entry])
+        else:
+            return freeze(entry)
+
+    def decode_records(self, entry):
+        if entry is None:
+            return []
+        elif not isinstance(entry, list):
+            raise SchemaViolation(f'wrong type of {entry}'
+                    f' (expected list, got {type(entry).__name__})')
+        elif self.schema is not None:
+            decode = self.schema.decode_records
+            return [decode(v) for v in entry]
         else:
             return entry
 
@@ -112,19 +411,56 @@ class NymlListSchema(NymlSchema):
             return [self.schema.encode(v) for v in entry]
         return entry
 
+    def compile_decode(self, src, dst, namespace, depth):
+        lines = [f'if {src} is None:',
+                 f'    {dst} = []',
+                 f'elif not isinstance({src}, list):']
+        lines += _wrong_type(src, 'list')
+        if self.schema is not None:
+            lines.append('else:')
+            if depth < COMPILE_DEPTH:
+                lines += _indent(self.schema.compile_items(src, dst, namespace,
+                                                           depth))
+            else:
+                decode = _bind(namespace, 'decode', self.schema.compile())
+                lines.append(f'    {dst} = [{decode}(v) for v in {src}]')
+        return lines
+
+    def compile_default(self, dst, namespace, depth):
+        # A shallow copy is as good as a deep one for lists of strings
+        if all(isinstance(v, str) for v in self.default):
+            default = _bind(namespace, 'default', self.default)
+            return [f'{dst} = {default}.copy()']
+        get_default = _bind(namespace, 'get_default', self.get_default)
+        return [f'{dst} = {get_default}()']
+
+    def compile_dump_guard(self, src):
+        return f'{src}.__class__ is not list and not isinstance({src}, list)'
+
+    def compile_dump_body(self, src, indent, namespace, depth):
+        if depth >= COMPILE_DEPTH:
+            dump = _bind(namespace, 'dump', _dump_function(self, indent))
+            return [f'{dump}({src}, out)']
+
+        item = f'v{depth}'
+        return ([f'for {item} in {src}:'] +
+                _indent(_dump_item(item, self.schema, indent, namespace,
+                                   depth)))
+
 
 class NymlDictSchema(NymlSchema):
-    def __init__(self, definition):
+    def __init__(self, definition, cache=None):
         super().__init__(definition)
 
         self.schema = None
         self.schemas = {}
 
         if 'schema' in definition:
-            self.schema = make_schema(definition['schema'])
+            self.schema = make_schema(definition['schema'], cache)
         elif 'schemas' in definition:
             for key in definition['schemas']:
-                self.schemas[key] = make_schema(definition['schemas'][key])
+                self.schemas[key] = make_schema(definition['schemas'][key],
+                                                cache)
 
         if self.default is None:
             self.default = {}
@@ -135,36 +471,171 @@ class NymlDictSchema(NymlSchema):
     def get_item_schema(self, key):
         return self.schemas.get(key, self.schema)
 
+    def fingerprint(self):
+        return super().fingerprint() + (
+                None if self.schema is None else self.schema.fingerprint(),
+                tuple((key, subschema.fingerprint())
+                      for key, subschema in self.schemas.items()))
+
     def get_default(self):
         return self.decode(copy.deepcopy(self.default))
 
-    def decode(self, entry):
+    def get_frozen_default(self):
+        default = self.__dict__.get('_frozen_default')
+        if default is None:
+            default = self._frozen_default = freeze(self.get_default())
+        return default
+
+    def decode(self, entry, stats=None):
         if entry is None:
             entry = {}
         elif not isinstance(entry, dict):
             raise SchemaViolation(f'wrong type of {entry}'
                     f' (expected dict, got {type(entry).__name__})')
 
-        keys = set(entry)
-
         # Per element schemas
-        for key, subschema in self.schemas.items():
+        schemas = self.schemas
+        for key, subschema in schemas.items():
             if key not in entry:
                 entry[key] = subschema.get_default()
+                if stats is not None:
+                    stats.add(defaults=1)
             else:
-                entry[key] = subschema.decode(entry[key])
-                keys.remove(key)
+                entry[key] = subschema.decode(entry[key], stats)
 
-        # Common schema for all other elements
+        # Common schema for all other elements, in document order like the
+        # compiled decoders
         if self.schema is not None:
-            for key in keys:
-                entry[key] = self.schema.decode(entry[key])
+            for key in entry:
+                if key not in schemas:
+                    entry[key] = self.schema.decode(entry[key], stats)
 
         return entry
 
+    def decode_frozen(self, entry):
+        if entry is None:
+            entry = {}
+        elif not isinstance(entry, dict):
+            raise SchemaViolation(f'wrong type of {entry}'
+                    f' (expected dict, got {type(entry).__name__})')
+
+        # Values are decoded in the order decode() takes them, so that the
+        # same violation is reported first, and kept in document order
+        schemas = self.schemas
+        schema = self.schema
+        decoded = {}
+        for key, subschema in schemas.items():
+            if key in entry:
+                decoded[key] = subschema.decode_frozen(entry[key])
+        result = {}
+        for key, value in entry.items():
+            if key in decoded:
+                result[key] = decoded[key]
+            elif schema is None:
+                result[key] = freeze(value)
+            else:
+                result[key] = schema.decode_frozen(value)
+        for key, subschema in schemas.items():
+            if key not in result:
+                result[key] = subschema.get_frozen_default()
+        return FrozenDict(result)
+
+    def get_record_class(self):
+        cls = self.__dict__.get('_record_class')
+        if cls is None and self.schemas:
+            cls = self._record_class = make_record_class(self.schemas)
+        return cls
+
+    def get_record_default(self):
+        return self.decode_records(copy.deepcopy(self.default))
+
+    def decode_records(self, entry):
+        if entry is None:
+            entry = {}
+        elif not isinstance(entry, dict):
+            raise SchemaViolation(f'wrong type of {entry}'
+                    f' (expected dict, got {type(entry).__name__})')
+
+        schemas = self.schemas
+        schema = self.schema
+        cls = self.get_record_class()
+        if cls is None:
+            if schema is not None:
+                for key, value in entry.items():
+                    entry[key] = schema.decode_records(value)
+            return entry
+
+        values = []
+        found = 0
+        for key, subschema in schemas.items():
+            if key in entry:
+                values.append(subschema.decode_records(entry[key]))
+                found += 1
+            else:
+                values.append(subschema.get_record_default())
+
+        # Keys without their own schema
+        extra = None
+        if found < len(entry):
+            extra = {}
+            for key, value in entry.items():
+                if key not in schemas:
+                    extra[key] = value if schema is None \
+                            else schema.decode_records(value)
+
+        return cls(*values, extra)
+
     def encode(self, entry):
         return self.encode_reduced(self.reduce(entry))
 
+    def compile_decode(self, src, dst, namespace, depth):
+        if depth >= COMPILE_DEPTH:
+            decode = _bind(namespace, 'decode', self.compile())
+            return [f'{dst} = {decode}({src})']
+
+        lines = [f'if {src} is None:',
+                 f'    {src} = {{}}']
+        if dst != src:
+            lines.append(f'    {dst} = {src}')
+        lines.append(f'elif not isinstance({src}, dict):')
+        lines += _wrong_type(src, 'dict')
+
+        # Per element schemas
+        value = f'v{depth}'
+        for key, subschema in self.schemas.items():
+            item = f'{src}[{key!r}]'
+            lines += [f'if {key!r} in {src}:',
+                      f'    {value} = {item}']
+            lines += _indent(subschema.compile_decode(value, item, namespace,
+                                                      depth + 1))
+            lines.append('else:')
+            lines += _indent(subschema.compile_default(item, namespace,
+                                                       depth + 1))
+
+        # Common schema for all other elements
+        if self.schema is not None:
+            key = f'k{depth}'
+            item = f'{src}[{key}]'
+            lines.append(f'for {key} in {src}:')
+            if self.schemas:
+                keys = _bind(namespace, 'keys', frozenset(self.schemas))
+                lines += [f'    if {key} in {keys}:',
+                          '        continue']
+            lines.append(f'    {value} = {item}')
+            lines += _indent(self.schema.compile_decode(value, item, namespace,
+                                                        depth + 1))
+
+        return lines
+
+    def compile_default(self, dst, namespace, depth):
+        # Decoding an empty dict fills in the defaults of all its elements
+        if not self.default and depth + 1 < COMPILE_DEPTH:
+            value = f'v{depth}'
+            return ([f'{dst} = {value} = {{}}'] +
+                    self.compile_decode(value, dst, namespace, depth + 1))
+        get_default = _bind(namespace, 'get_default', self.get_default)
+        return [f'{dst} = {get_default}()']
+
     def encode_reduced(self, entry):
         for key in entry:
             subschema = self.get_item_schema(key)
@@ -194,17 +665,69 @@ class NymlDictSchema(NymlSchema):
 
         return new_dict
 
+    def compile_dump_guard(self, src):
+        return (f'{src}.__class__ is not dict'
+                f' and not isinstance({src}, MAPPINGS)')
 
-def make_schema(definition):
+    def compile_dump_body(self, src, indent, namespace, depth):
+        if depth >= COMPILE_DEPTH:
+            dump = _bind(namespace, 'dump', _dump_function(self, indent))
+            return [f'{dump}({src}, out)']
+
+        lines = []
+        value = f'v{depth}'
+
+        # Per element schemas, in schema order
+        for key, subschema in self.schemas.items():
+            literal = repr(key) if isinstance(key, str) \
+                    else _bind(namespace, 'key', key)
+            lines += [f'{value} = {src}.get({literal}, MISSING)',
+                      f'if {value} is not MISSING:']
+            if _valid_key(key):
+                head = f'{indent}{key}:'
+                lines += _indent(_dump_entry(value, subschema,
+                                             repr(head + ' '),
+                                             repr(head + '\n'),
+                                             indent, namespace, depth))
+            else:
+                lines.append('    raise _Fallback')
+
+        # All other elements, in the order of the dict
+        key = f'k{depth}'
+        head = f'h{depth}'
+        lines.append(f'for {key} in {src}:')
+        if self.schemas:
+            keys = _bind(namespace, 'keys', frozenset(self.schemas))
+            lines += [f'    if {key} in {keys}:',
+                      '        continue']
+        entry = [f'{value} = {src}[{key}]',
+                 f'{head} = str({key})',
+                 f"if {head}.startswith(('-', '+', '>'))"
+                 f" or {head}.find(':') != -1"
+                 f" or {head}.find('\\n') != -1:",
+                 '    raise _Fallback',
+                 f"{head} = {indent!r} + {head} + ':'"]
+        entry += _dump_entry(value, self.schema, f"{head} + ' '",
+                             f"{head} + '\\n'", indent, namespace, depth)
+        lines += _indent(entry)
+        return lines
+
+
+def make_schema(definition, cache=None):
+    if cache is not None:
+        return cache.get(definition)
+    return _new_schema(definition, None)
+
+def _new_schema(definition, cache):
     if definition is None:
         definition = {}
 
     typename = definition.get('type', 'str')
 
     if typename == 'dict':
-        return NymlDictSchema(definition)
+        return NymlDictSchema(definition, cache)
     elif typename == 'list':
-        return NymlListSchema(definition)
+        return NymlListSchema(definition, cache)
     elif typename == 'bool':
         return NymlBoolSchema(definition)
     elif typename == 'int':
@@ -213,3 +736,73 @@ def make_schema(definition):
         return NymlStrSchema(definition)
     else:
         raise SchemaError(f'invalid type {typename}')
+
+def canonical_key(definition):
+    # Hashable form of a schema definition. Key order is kept, as it decides
+    # the order of defaults in decoded dicts.
+    if isinstance(definition, dict):
+        return ('dict',) + tuple((key, canonical_key(value))
+                                 for key, value in definition.items())
+    elif isinstance(definition, list):
+        return ('list',) + tuple(canonical_key(value) for value in definition)
+    return definition
+
+
+class SchemaCache:
+    # Schemas are never modified once made, so equal definitions can share
+    # one schema object, down to the sub-schemas. Entries are kept in LRU
+    # order and keyed by definition, by schema text or by file path.
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.lock = threading.RLock()
+
+    def lookup(self, key):
+        schema = self.entries.get(key)
+        if schema is not None:
+            self.entries.move_to_end(key)
+        return schema
+
+    def store(self, key, schema):
+        self.entries[key] = schema
+        if self.maxsize is not None and len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def get(self, definition):
+        key = ('definition', canonical_key(definition))
+        with self.lock:
+            schema = self.lookup(key)
+            if schema is None:
+                # Sub-schemas are looked up in the cache as well
+                schema = _new_schema(definition, self)
+                self.store(key, schema)
+            return schema
+
+    def loads(self, text):
+        from . import loads
+
+        key = ('text', text)
+        with self.lock:
+            schema = self.lookup(key)
+            if schema is None:
+                schema = self.get(loads(text))
+                self.store(key, schema)
+            return schema
+
+    def load_file(self, path):
+        from . import load_file
+
+        # A file is read again only if it has changed since
+        st = os.stat(path)
+        key = ('file', os.fspath(path))
+        with self.lock:
+            entry = self.lookup(key)
+            if entry is not None and entry[0] == (st.st_mtime_ns, st.st_size):
+                return entry[1]
+            schema = self.get(load_file(path))
+            self.store(key, ((st.st_mtime_ns, st.st_size), schema))
+            return schema
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,124 @@
+from .parser import Parser
+from .schema import NymlDictSchema, NymlListSchema
+
+# Value of a key being skipped, the key is dropped when its frame closes
+_SKIPPED = object()
+
+def make_selection(paths):
+    # Paths like 'meta/date' become a trie of dicts, an empty dict selects
+    # the whole subtree. Lists on the way are looked through.
+    selection = {}
+    for path in paths:
+        node = selection
+        keys = path.split('/')
+        for key in keys[:-1]:
+            node = node.setdefault(key, {})
+        # Marks the subtree as selected as a whole
+        node.setdefault(keys[-1], {})[None] = None
+    return _prune(selection)
+
+def _prune(node):
+    # A subtree selected both as a whole and in part is selected as a whole
+    if None in node:
+        return {}
+    return {key: _prune(value) for key, value in node.items()}
+
+
+class SelectParser(Parser):
+    # Skips lines that belong to keys outside the selection without parsing
+    # them. Once every selected top level key is complete, self.done is set
+    # and the rest of the header can be left unread.
+    def __init__(self, selection):
+        super().__init__()
+        self.selection = selection
+        self.pending = set(selection)
+        self.skip_markers = False
+        self.new_key = False
+        self.done = False
+
+    def feed(self, line):
+        if self.element is _SKIPPED:
+            no_indent_line = line.lstrip()
+            line_indent = len(line) - len(no_indent_line)
+            # The key is at self.indent - 2. A list may start at the same
+            # indentation as the key if the latter has no value.
+            if line_indent >= self.indent or (
+                    self.skip_markers and line_indent == self.indent - 2
+                    and no_indent_line[:1] in ('-', '+')):
+                self.lineno += 1
+                return
+
+        self.new_key = False
+        super().feed(line)
+        if not self.new_key:
+            return
+
+        stack = self.stack
+        keys = [key for _, _, key in stack if key is not None]
+        if len(keys) == 1 and stack[0][2] is not None:
+            if not self.pending:
+                self.done = True
+            self.pending.discard(keys[0])
+
+        node = self.selection
+        for key in keys:
+            if not node:
+                return
+            node = node.get(key)
+            if node is None:
+                break
+        else:
+            if not self.done:
+                return
+
+        self.skip_markers = self.element is None
+        self.element = _SKIPPED
+
+    def parse_line(self, line):
+        depth = len(self.stack)
+        super().parse_line(line)
+        self.new_key = len(self.stack) > depth and self.stack[-1][2] is not None
+
+    def attach(self, parent, key, element):
+        if element is not _SKIPPED:
+            super().attach(parent, key, element)
+
+
+def apply_selection(element, schema, selection):
+    if schema is None or not selection:
+        if schema is None:
+            return element
+        return schema.get_default() if element is None \
+                else schema.decode(element)
+
+    if isinstance(schema, NymlDictSchema):
+        if element is None:
+            element = {}
+        if isinstance(element, dict):
+            for key, value in element.items():
+                element[key] = apply_selection(value,
+                                               schema.get_item_schema(key),
+                                               selection.get(key))
+            # Defaults only for the selected keys
+            for key, subschema in schema.schemas.items():
+                if key in selection and key not in element:
+                    element[key] = _select_default(subschema, selection[key])
+            return element
+    elif isinstance(schema, NymlListSchema) and isinstance(element, list):
+        return [apply_selection(value, schema.schema, selection)
+                for value in element]
+
+    return schema.get_default() if element is None else schema.decode(element)
+
+def _select_default(schema, selection):
+    return _prune_value(schema.get_default(), selection)
+
+def _prune_value(value, selection):
+    if not selection:
+        return value
+    if isinstance(value, dict):
+        return {key: _prune_value(v, selection[key])
+                for key, v in value.items() if key in selection}
+    elif isinstance(value, list):
+        return [_prune_value(v, selection) for v in value]
+    return value
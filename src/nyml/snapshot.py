@@ -0,0 +1,192 @@
+import contextlib
+import hashlib
+import marshal
+import mmap
+import os
+import struct
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# Pack layout: MAGIC, marshalled documents, marshalled index, trailer. The
+# index maps (path, text_key) to (stat fingerprint, schema digest, offset,
+# length) of a document. Changed documents are appended in place of the
+# old index, their previous copies are dropped when the pack is rewritten.
+MAGIC = b'NYMLSNP1'
+_TRAILER = struct.Struct('<Q8s')
+
+@contextlib.contextmanager
+def _locked(path):
+    # Exclusive lock on a file next to the pack, held by one writer at a
+    # time across processes. The pack itself is replaced by rewrites.
+    with open(f'{path}.lock', 'a+b') as fp:
+        if fcntl is not None:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+        else:
+            fp.seek(0)
+            msvcrt.locking(fp.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+            else:
+                fp.seek(0)
+                msvcrt.locking(fp.fileno(), msvcrt.LK_UNLCK, 1)
+
+def schema_digest(schema):
+    if schema is None:
+        return ''
+    return hashlib.sha1(marshal.dumps(schema.fingerprint())).hexdigest()
+
+
+class SnapshotCache:
+    def __init__(self, path):
+        self.path = path
+        self.index = {}
+        # Documents parsed since the last save(), by index key
+        self.pending = {}
+        self.digests = {}
+        # Offset of the index in the pack, None if the pack must be rewritten
+        self.end = None
+        self.garbage = 0
+        self.fp = None
+        self.mm = None
+        self.lock = threading.Lock()
+        self.open()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        try:
+            fp = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+
+        size = os.fstat(fp.fileno()).st_size
+        if size < len(MAGIC) + _TRAILER.size:
+            fp.close()
+            return
+
+        mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            offset, magic = _TRAILER.unpack_from(mm, size - _TRAILER.size)
+            if mm[:len(MAGIC)] != MAGIC or magic != MAGIC:
+                raise ValueError('not a snapshot pack')
+            index = marshal.loads(mm[offset:size - _TRAILER.size])
+        except (ValueError, EOFError, TypeError):
+            # Damaged packs are rebuilt from scratch by the next save()
+            mm.close()
+            fp.close()
+            return
+
+        self.fp, self.mm, self.index, self.end = fp, mm, index, offset
+        live = sum(entry[3] for entry in index.values())
+        self.garbage = offset - len(MAGIC) - live
+
+    def unmap(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.fp.close()
+            self.mm = self.fp = None
+
+    def close(self):
+        self.save()
+        self.unmap()
+
+    def digest(self, schema):
+        digest = self.digests.get(schema)
+        if digest is None:
+            digest = self.digests[schema] = schema_digest(schema)
+        return digest
+
+    def load(self, path, schema=None, text_key=None):
+        from . import load_file
+
+        st = os.stat(path)
+        fingerprint = (st.st_mtime_ns, st.st_size, st.st_ino)
+        key = (os.path.abspath(path), text_key)
+
+        with self.lock:
+            digest = self.digest(schema)
+            entry = self.pending.get(key)
+            if entry is not None:
+                if entry[:2] == (fingerprint, digest):
+                    return marshal.loads(entry[2])
+            else:
+                entry = self.index.get(key)
+                if entry is not None and entry[:2] == (fingerprint, digest):
+                    offset, length = entry[2:]
+                    return marshal.loads(self.mm[offset:offset + length])
+
+        data = load_file(path, schema, text_key)
+        blob = marshal.dumps(data)
+        with self.lock:
+            self.pending[key] = (fingerprint, digest, blob)
+        return data
+
+    def save(self):
+        with self.lock:
+            if not self.pending:
+                return
+            with _locked(self.path):
+                # Other processes may have saved since the pack was opened,
+                # the pending documents go on top of what they wrote.
+                self.reopen()
+                live = sum(entry[3] for entry in self.index.values())
+                if self.end is None or self.garbage > live:
+                    self.rewrite()
+                else:
+                    self.append()
+                self.pending = {}
+            self.reopen()
+
+    def reopen(self):
+        self.unmap()
+        self.index = {}
+        self.end = None
+        self.garbage = 0
+        self.open()
+
+    def append(self):
+        self.unmap()
+        with open(self.path, 'r+b') as fp:
+            fp.seek(self.end)
+            fp.truncate()
+            self.write_entries(fp, self.pending.items())
+
+    def rewrite(self):
+        entries = list(self.pending.items())
+        if self.mm is not None:
+            for key, (fingerprint, digest, offset, length) in \
+                    self.index.items():
+                if key not in self.pending:
+                    entries.append((key, (fingerprint, digest,
+                                          self.mm[offset:offset + length])))
+        self.unmap()
+        self.index = {}
+
+        # Written aside and moved over the pack, so a pack is never seen
+        # half written.
+        tmp_path = f'{self.path}.tmp{os.getpid()}'
+        with open(tmp_path, 'wb') as fp:
+            fp.write(MAGIC)
+            self.write_entries(fp, entries)
+        os.replace(tmp_path, self.path)
+
+    def write_entries(self, fp, entries):
+        index = self.index
+        for key, (fingerprint, digest, blob) in entries:
+            index[key] = (fingerprint, digest, fp.tell(), len(blob))
+            fp.write(blob)
+        offset = fp.tell()
+        fp.write(marshal.dumps(index))
+        fp.write(_TRAILER.pack(offset, MAGIC))
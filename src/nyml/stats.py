@@ -0,0 +1,107 @@
+import contextlib
+import threading
+import time
+
+class Stats:
+    # Optional collector passed to load(), dumps() and schema.decode().
+    # Phase times are in seconds. Updates are locked, so one collector can be
+    # shared by threads, and collectors from worker processes can be pickled
+    # and merged.
+    def __init__(self):
+        self.times = {}
+        self.counts = {}
+        self.maxima = {}
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        with self.lock:
+            return (self.times, self.counts, self.maxima)
+
+    def __setstate__(self, state):
+        self.times, self.counts, self.maxima = state
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f'Stats({self.as_dict()!r})'
+
+    def as_dict(self):
+        with self.lock:
+            return {'times': dict(self.times),
+                    'counts': dict(self.counts),
+                    'maxima': dict(self.maxima)}
+
+    def add_time(self, phase, seconds):
+        with self.lock:
+            self.times[phase] = self.times.get(phase, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def add(self, **counts):
+        with self.lock:
+            for name, n in counts.items():
+                self.counts[name] = self.counts.get(name, 0) + n
+
+    def maximum(self, **values):
+        with self.lock:
+            for name, value in values.items():
+                if name not in self.maxima or value > self.maxima[name]:
+                    self.maxima[name] = value
+
+    def merge(self, other):
+        state = other.as_dict()
+        for phase, seconds in state['times'].items():
+            self.add_time(phase, seconds)
+        self.add(**state['counts'])
+        self.maximum(**state['maxima'])
+
+    def count_nodes(self, element):
+        dicts = lists = scalars = 0
+        max_depth = 0
+        stack = [(element, 0)] if element is not None else []
+        while stack:
+            element, depth = stack.pop()
+            if depth > max_depth:
+                max_depth = depth
+            if isinstance(element, dict):
+                dicts += 1
+                stack.extend((v, depth + 1) for v in element.values())
+            elif isinstance(element, list):
+                lists += 1
+                stack.extend((v, depth + 1) for v in element)
+            else:
+                scalars += 1
+        self.add(dicts=dicts, lists=lists, scalars=scalars)
+        self.maximum(depth=max_depth)
+
+
+class CountingLines:
+    # Passes lines through, counting them and their characters
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.count = 0
+        self.chars = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = next(self.lines)
+        self.count += 1
+        self.chars += len(line)
+        return line
+
+
+class CountingWriter:
+    def __init__(self, write):
+        self.target = write
+        self.chars = 0
+
+    def write(self, s):
+        self.chars += len(s)
+        self.target(s)
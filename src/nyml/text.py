@@ -0,0 +1,44 @@
+import mmap
+import os
+
+class LazyText:
+    # Body of a document that is read from the file only when needed. The
+    # text is not kept around, every read() goes to the file.
+    def __init__(self, path, offset, encoding='utf-8'):
+        self.path = path
+        self.offset = offset
+        self.encoding = encoding
+
+    def __repr__(self):
+        return f'LazyText({self.path!r}, {self.offset})'
+
+    def __str__(self):
+        return self.read()
+
+    def __bool__(self):
+        return os.path.getsize(self.path) > self.offset
+
+    def __eq__(self, other):
+        if isinstance(other, LazyText):
+            other = other.read()
+        if isinstance(other, str):
+            return self.read() == other
+        return NotImplemented
+
+    def open(self):
+        fp = open(self.path, 'rb')
+        fp.seek(self.offset)
+        return fp
+
+    def read(self):
+        with self.open() as fp:
+            text = fp.read().decode(self.encoding)
+        # Same newline translation as for files opened in text mode
+        return text.replace('\r\n', '\n').replace('\r', '\n')
+
+    def mmap(self):
+        with open(self.path, 'rb') as fp:
+            if os.fstat(fp.fileno()).st_size <= self.offset:
+                return memoryview(b'')
+            mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(mm)[self.offset:]
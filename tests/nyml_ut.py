@@ -2,9 +2,18 @@
 #
 # NYML unittest
 #
+import asyncio
+import copy
+import io
+import marshal
+import mmap
 import os
+import pickle
+import subprocess
 import sys
+import tempfile
 import unittest
+import unittest.mock
 
 SRCDIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src'))
 sys.path.insert(0, SRCDIR)
@@ -363,5 +372,1431 @@ class NymlParserTests(unittest.TestCase):
         self.assertEqual(text, nyml.dumps(data))
 
 
+    def test_list_deep_nesting(self):
+        depth = 5000
+        data = nyml.loads('+ ' * depth + '- a\n')
+        for _ in range(depth):
+            self.assertEqual(1, len(data))
+            data = data[0]
+        self.assertEqual(['a'], data)
+
+    def test_str_long_multiline(self):
+        data = { 'a': '\n'.join(f'line{i}' for i in range(10000)) }
+        self.assertEqual(data, nyml.loads(nyml.dumps(data)))
+
+    def test_text_key(self):
+        text = ('a: 1\n'
+                '\n'
+                'body\n'
+                'more\n')
+        data = { 'a': '1', 'text': 'body\nmore\n' }
+        self.assertEqual(data, nyml.loads(text, text_key='text'))
+        self.assertEqual(text, nyml.dumps(data, text_key='text'))
+
+
+class NymlIncrementalLoaderTests(unittest.TestCase):
+    text = ('a: 1\n'
+            'b:\n'
+            '  c: multi\n'
+            '    line\n'
+            'd:\n'
+            '+ - x\n'
+            '  - y\n'
+            '- z\n'
+            '\n'
+            'body\n')
+
+    def feed(self, loader, data, size):
+        for i in range(0, len(data), size):
+            loader.feed(data[i:i + size])
+        return loader.close()
+
+    def test_chunks(self):
+        expected = nyml.loads(self.text)
+        for size in range(1, len(self.text) + 1):
+            loader = nyml.IncrementalLoader()
+            self.assertEqual(expected, self.feed(loader, self.text, size))
+
+    def test_text_key(self):
+        expected = nyml.loads(self.text, text_key='text')
+        for size in range(1, len(self.text) + 1):
+            loader = nyml.IncrementalLoader(text_key='text')
+            self.assertEqual(expected, self.feed(loader, self.text, size))
+
+    def test_no_trailing_newline(self):
+        loader = nyml.IncrementalLoader()
+        self.assertEqual({ 'a': '1' }, self.feed(loader, 'a: 1', 1))
+
+    def test_encoding(self):
+        data = 'key: значение\n'.encode()
+        loader = nyml.IncrementalLoader(encoding='utf-8')
+        self.assertEqual({ 'key': 'значение' }, self.feed(loader, data, 1))
+
+    def test_schema(self):
+        schema = make_schema_from_string('type: dict\n'
+                                         'schemas:\n'
+                                         '  a:\n'
+                                         '    type: int\n'
+                                         '  e:\n'
+                                         '    type: bool\n')
+        loader = nyml.IncrementalLoader(schema)
+        data = self.feed(loader, self.text, 7)
+        self.assertEqual(1, data['a'])
+        self.assertEqual(False, data['e'])
+
+    def test_malformed(self):
+        loader = nyml.IncrementalLoader()
+        with self.assertRaises(nyml.ParseError) as cm:
+            self.feed(loader, 'a: 1\nb: str\nc\n', 3)
+        self.assertEqual('unexpected string at line 3: c', str(cm.exception))
+
+
+class NymlIterparseTests(unittest.TestCase):
+    def iterparse(self, text):
+        return list(nyml.iterparse(text.splitlines(keepends=True)))
+
+    def test_empty(self):
+        self.assertEqual([], self.iterparse(''))
+
+    def test_str(self):
+        self.assertEqual([('scalar', 'line1\nline2')],
+                         self.iterparse('line1\nline2\n'))
+
+    def test_dict(self):
+        text = ('a: 1\n'
+                'b:\n'
+                '  c: 2\n'
+                'd:\n'
+                '- x\n'
+                '+ - y\n'
+                '  - z\n'
+                'e:\n'
+                '\n'
+                'body: ignored\n')
+        events = [('start_dict', None),
+                  ('key', 'a'), ('scalar', '1'),
+                  ('key', 'b'), ('start_dict', None),
+                  ('key', 'c'), ('scalar', '2'),
+                  ('end', None),
+                  ('key', 'd'), ('start_list', None),
+                  ('scalar', 'x'),
+                  ('start_list', None),
+                  ('scalar', 'y'), ('scalar', 'z'),
+                  ('end', None),
+                  ('end', None),
+                  ('key', 'e'), ('scalar', None),
+                  ('end', None)]
+        self.assertEqual(events, self.iterparse(text))
+
+    def test_list_of_dicts(self):
+        text = ('+ a: 1\n'
+                '  b: 2\n'
+                '+ c: 3\n')
+        events = [('start_list', None),
+                  ('start_dict', None),
+                  ('key', 'a'), ('scalar', '1'),
+                  ('key', 'b'), ('scalar', '2'),
+                  ('end', None),
+                  ('start_dict', None),
+                  ('key', 'c'), ('scalar', '3'),
+                  ('end', None),
+                  ('end', None)]
+        self.assertEqual(events, self.iterparse(text))
+
+    def test_malformed(self):
+        events = nyml.iterparse(['a: 1\n', 'b: str\n', '- c\n'])
+        self.assertEqual(('start_dict', None), next(events))
+        with self.assertRaises(nyml.ParseError) as cm:
+            list(events)
+        self.assertEqual('unexpected list at line 3: - c', str(cm.exception))
+
+
+class NymlDumpTests(unittest.TestCase):
+    class Writer:
+        def __init__(self):
+            self.chunks = []
+
+        def write(self, s):
+            self.chunks.append(s)
+
+    def test_dump_buffered(self):
+        data = { 'key%d' % i: [ 'item', { 'a': 'multi\nline' } ]
+                 for i in range(100) }
+        fp = self.Writer()
+        nyml.dump(data, fp, buffer_size=256)
+        self.assertEqual(nyml.dumps(data), ''.join(fp.chunks))
+        self.assertGreater(len(fp.chunks), 1)
+        self.assertTrue(all(len(c) < 512 for c in fp.chunks))
+
+    def test_dump_schema_text_key(self):
+        schema = make_schema_from_string('type: dict\n'
+                                         'schemas:\n'
+                                         '  flag:\n'
+                                         '    type: bool\n')
+        data = { 'flag': True, 'text': 'x' * 1000 }
+        expected = nyml.dumps(dict(data), schema, 'text')
+        fp = self.Writer()
+        nyml.dump(data, fp, schema, 'text', buffer_size=16)
+        self.assertEqual(expected, ''.join(fp.chunks))
+
+
+class NymlLoadFileTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'page.nyml')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write_file(self, data):
+        with open(self.path, 'wb') as f:
+            f.write(data)
+
+    def test_lazy_text(self):
+        self.write_file('title: Заголовок\r\n'
+                        'tags:\r\n'
+                        '- a\r\n'
+                        '\r\n'
+                        'body\r\n'
+                        'more\r\n'.encode())
+        with open(self.path) as f:
+            expected = nyml.load(f, text_key='text')
+        data = nyml.load_file(self.path, text_key='text', lazy_text=True)
+        self.assertIsInstance(data['text'], nyml.LazyText)
+        self.assertEqual(expected, data)
+        self.assertEqual(b'body\r\nmore\r\n', bytes(data['text'].mmap()))
+        self.assertEqual(expected, nyml.load_file(self.path, text_key='text'))
+
+    def test_lazy_text_line_breaks(self):
+        # Lone \r breaks lines as in universal newlines mode
+        for data in (b'a: 1\rb: 2\n\nbody\r',
+                     b'a: 1\r\rbody\n',
+                     b'a: 1\nb:\r- x\r\n\r\nbody\rmore'):
+            self.write_file(data)
+            with open(self.path) as f:
+                expected = nyml.load(f, text_key='text')
+            for lazy_text in (False, True):
+                self.assertEqual(expected,
+                                 nyml.load_file(self.path, text_key='text',
+                                                lazy_text=lazy_text))
+            index = nyml.PositionIndex()
+            self.assertEqual(expected,
+                             nyml.load_file(self.path, text_key='text',
+                                            index=index))
+            for path in index.positions:
+                node = expected
+                for key in path:
+                    node = node[key]
+                self.assertEqual(node,
+                                 nyml.load_subtree(self.path, index, path))
+
+    def test_lazy_text_empty(self):
+        self.write_file(b'title: x\n')
+        data = nyml.load_file(self.path, text_key='text', lazy_text=True)
+        self.assertFalse(data['text'])
+        self.assertEqual('', data['text'].read())
+        self.assertEqual(b'', bytes(data['text'].mmap()))
+        self.assertEqual('title: x\n', nyml.dumps(data, text_key='text'))
+
+    def test_lazy_text_schema(self):
+        schema = make_schema_from_string('type: dict\n'
+                                         'schemas:\n'
+                                         '  draft:\n'
+                                         '    type: bool\n')
+        self.write_file(b'draft: yes\n\nbody\n')
+        data = nyml.load_file(self.path, schema, 'text', lazy_text=True)
+        self.assertEqual(True, data['draft'])
+        self.assertEqual('body\n', str(data['text']))
+
+
+class NymlLoadManyTests(unittest.TestCase):
+    schema_text = ('type: dict\n'
+                   'schemas:\n'
+                   '  id:\n'
+                   '    type: int\n'
+                   '  tags:\n'
+                   '    type: list\n')
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.paths = []
+        for i in range(20):
+            path = os.path.join(self.dir.name, f'{i}.nyml')
+            with open(path, 'w') as f:
+                f.write(f'id: {i}\n\nbody {i}\n')
+            self.paths.append(path)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def expected(self, schema):
+        return [(path, nyml.load_file(path, schema, 'text'))
+                for path in self.paths]
+
+    def test_ordered(self):
+        schema = make_schema_from_string(self.schema_text)
+        for workers in (1, 2):
+            results = nyml.load_many(self.paths, schema, 'text',
+                                     workers=workers, chunksize=3)
+            self.assertEqual(self.expected(schema), list(results))
+
+    def test_unordered(self):
+        schema = make_schema_from_string(self.schema_text)
+        results = nyml.load_many(self.paths, schema, 'text', workers=2,
+                                 chunksize=3, ordered=False)
+        self.assertEqual(sorted(self.expected(schema)), sorted(results))
+
+    def test_errors(self):
+        schema = make_schema_from_string(self.schema_text)
+        with open(self.paths[1], 'w') as f:
+            f.write('id: one\n')
+        missing = os.path.join(self.dir.name, 'missing.nyml')
+        paths = self.paths[:3] + [missing]
+        results = list(nyml.load_many(paths, schema, workers=2))
+        self.assertEqual([0, 2], [r['id'] for _, r in results[::2]])
+        self.assertIsInstance(results[1][1], nyml.SchemaViolation)
+        self.assertEqual('invalid integer value: one', str(results[1][1]))
+        self.assertIsInstance(results[3][1], FileNotFoundError)
+
+
+class NymlCompiledSchemaTests(unittest.TestCase):
+    schema_text = ('type: dict\n'
+                   'schemas:\n'
+                   '  id:\n'
+                   '    type: int\n'
+                   '  flag:\n'
+                   '    type: bool\n'
+                   '    default: yes\n'
+                   '  name:\n'
+                   '    default: anonymous\n'
+                   '  tags:\n'
+                   '    type: list\n'
+                   '    default:\n'
+                   '      - a\n'
+                   '  counts:\n'
+                   '    type: list\n'
+                   '    schema:\n'
+                   '      type: int\n'
+                   '  meta:\n'
+                   '    type: dict\n'
+                   '    schemas:\n'
+                   '      level:\n'
+                   '        type: int\n'
+                   '        default: 3\n'
+                   '      deep:\n'
+                   '        type: dict\n'
+                   '        schemas:\n'
+                   '          deeper:\n'
+                   '            type: dict\n'
+                   '            schemas:\n'
+                   '              deepest:\n'
+                   '                type: dict\n'
+                   '                schema:\n'
+                   '                  type: bool\n'
+                   '  vars:\n'
+                   '    type: dict\n'
+                   '    schema:\n'
+                   '      type: int\n')
+
+    texts = ['',
+             'id: 1\n',
+             ('id: 7\n'
+              'flag: no\n'
+              'name:\n'
+              'tags:\n'
+              '- x\n'
+              'counts:\n'
+              '- 1\n'
+              '- 2\n'
+              'meta:\n'
+              '  deep:\n'
+              '    deeper:\n'
+              '      deepest:\n'
+              '        a: yes\n'
+              'vars:\n'
+              '  x: 1\n'
+              'extra: value\n')]
+
+    def test_same_as_decode(self):
+        schema = make_schema_from_string(self.schema_text)
+        decode = schema.compile()
+        for text in self.texts:
+            self.assertEqual(nyml.loads(text, schema),
+                             decode(nyml.loads(text) or {}))
+
+    def test_defaults_not_shared(self):
+        schema = make_schema_from_string(self.schema_text)
+        decode = schema.compile()
+        first = decode({})
+        first['tags'].append('b')
+        first['meta']['level'] = 4
+        self.assertEqual(['a'], decode({})['tags'])
+        self.assertEqual(3, decode({})['meta']['level'])
+
+    def test_schema_violations(self):
+        schema = make_schema_from_string(self.schema_text)
+        decode = schema.compile()
+        texts = ['id: one\n',
+                 'counts:\n- 1\n- x\n',
+                 'tags: x\n',
+                 'meta: x\n',
+                 'vars:\n  a: 1\n  b:\n']
+        for text in texts:
+            with self.assertRaises(nyml.SchemaViolation) as cm:
+                nyml.loads(text, schema)
+            with self.assertRaises(nyml.SchemaViolation) as cm2:
+                decode(nyml.loads(text))
+            self.assertEqual(str(cm.exception), str(cm2.exception))
+
+    def test_scalars(self):
+        int_decode = make_schema_from_string('type: int').compile()
+        self.assertEqual(42, int_decode('42'))
+        bool_decode = make_schema_from_string('type: bool').compile()
+        self.assertEqual(True, bool_decode('on'))
+        str_decode = make_schema_from_string('type: str').compile()
+        self.assertEqual('', str_decode(None))
+
+    def test_violation_order(self):
+        # The first value to fail in decode order is reported
+        cases = [('type: list\n'
+                  'schema:\n'
+                  '  type: int\n', '- x\n+ a: 1\n'),
+                 ('type: dict\n'
+                  'schema:\n'
+                  '  type: list\n', 'b: x\na:\n  c: 1\nc: y\n'),
+                 (self.schema_text, 'meta:\n  level: x\nid: y\n')]
+        for schema_text, text in cases:
+            schema = make_schema_from_string(schema_text)
+            with self.assertRaises(nyml.SchemaViolation) as cm:
+                nyml.loads(text, schema)
+            with self.assertRaises(nyml.SchemaViolation) as cm2:
+                schema.get_decoder()(nyml.loads(text))
+            self.assertEqual(str(cm.exception), str(cm2.exception))
+
+    def test_pickle(self):
+        schema = make_schema_from_string(self.schema_text)
+        text = self.texts[2]
+        expected = schema.get_decoder()(nyml.loads(text))
+        copied = pickle.loads(pickle.dumps(schema))
+        self.assertNotIn('_decoder', copied.__dict__)
+        self.assertEqual(expected, copied.get_decoder()(nyml.loads(text)))
+
+
+class NymlSchemaCacheTests(unittest.TestCase):
+    schema_text = NymlCompiledSchemaTests.schema_text
+
+    def test_same_definition(self):
+        cache = nyml.SchemaCache()
+        first = nyml.make_schema(nyml.loads(self.schema_text), cache)
+        second = nyml.make_schema(nyml.loads(self.schema_text), cache)
+        self.assertIs(first, second)
+        self.assertIs(first, cache.loads(self.schema_text))
+        self.assertEqual(nyml.loads('id: 1\n', first),
+                         nyml.loads('id: 1\n', make_schema_from_string(
+                                self.schema_text)))
+
+    def test_shared_subschemas(self):
+        cache = nyml.SchemaCache()
+        first = cache.loads('type: list\nschema:\n  type: int\n')
+        second = cache.loads('type: dict\nschema:\n  type: int\n')
+        self.assertIs(first.schema, second.schema)
+        self.assertIsNot(cache.loads('type: int\ndefault: 1\n'),
+                         first.schema)
+
+    def test_lru(self):
+        cache = nyml.SchemaCache(maxsize=2)
+        first = cache.get({'type': 'int'})
+        second = cache.get({'type': 'bool'})
+        self.assertIs(first, cache.get({'type': 'int'}))
+        cache.get({'type': 'str'})
+        self.assertEqual(2, len(cache.entries))
+        self.assertIs(first, cache.get({'type': 'int'}))
+        self.assertIsNot(second, cache.get({'type': 'bool'}))
+
+    def test_file(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'schema.nyml')
+            with open(path, 'w') as f:
+                f.write('type: int\n')
+            cache = nyml.SchemaCache()
+            first = cache.load_file(path)
+            self.assertIs(first, cache.load_file(path))
+            with open(path, 'w') as f:
+                f.write('type: bool\ndefault: yes\n')
+            st = os.stat(path)
+            os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+            self.assertEqual(True, cache.load_file(path).get_default())
+
+
+class NymlDocumentCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name, text):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_hit_and_copy(self):
+        path = self.write('a.nyml', 'a: 1\nb:\n- x\n')
+        cache = nyml.DocumentCache()
+        first = cache.load(path)
+        first['b'].append('y')
+        second = cache.load(path)
+        self.assertEqual({'a': '1', 'b': ['x']}, second)
+        second['b'].append('z')
+        self.assertEqual({'a': '1', 'b': ['x']}, cache.load(path))
+        stats = cache.stats()
+        self.assertEqual((2, 1), (stats['hits'], stats['misses']))
+
+    def test_schema_and_text_key(self):
+        path = self.write('a.nyml', 'a: 1\n\nbody\n')
+        schema = make_schema_from_string('type: dict\n'
+                                         'schemas:\n'
+                                         '  a:\n'
+                                         '    type: int\n')
+        cache = nyml.DocumentCache()
+        self.assertEqual({'a': 1, 'text': 'body\n'},
+                         cache.load(path, schema, 'text'))
+        self.assertEqual({'a': '1', 'text': 'body\n'},
+                         cache.load(path, None, 'text'))
+        self.assertEqual(2, cache.stats()['misses'])
+
+    def test_invalidation(self):
+        path = self.write('a.nyml', 'a: 1\n')
+        cache = nyml.DocumentCache()
+        cache.load(path)
+        self.write('a.nyml', 'a: 22\n')
+        self.assertEqual({'a': '22'}, cache.load(path))
+        self.assertEqual(2, cache.stats()['misses'])
+
+    def test_eviction(self):
+        paths = [self.write(f'{i}.nyml', 'a: 1\n') for i in range(3)]
+        cache = nyml.DocumentCache(maxsize=2)
+        for path in paths:
+            cache.load(path)
+        cache.load(paths[2])
+        stats = cache.stats()
+        self.assertEqual((1, 2, 1), (stats['evictions'], stats['entries'],
+                                     stats['hits']))
+
+        # Entries are charged the size of the marshalled tree
+        size = len(marshal.dumps({'a': '1'}))
+        cache = nyml.DocumentCache(maxbytes=2 * size)
+        for path in paths:
+            cache.load(path)
+        stats = cache.stats()
+        self.assertEqual((2, 2 * size), (stats['entries'], stats['bytes']))
+
+
+class NymlSnapshotCacheTests(unittest.TestCase):
+    schema_text = ('type: dict\n'
+                   'schemas:\n'
+                   '  a:\n'
+                   '    type: int\n')
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.pack = os.path.join(self.tmpdir.name, 'pack')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name, text):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        st = os.stat(path)
+        # Make sure rewrites are noticed despite coarse timestamps
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        return path
+
+    def test_reload(self):
+        schema = make_schema_from_string(self.schema_text)
+        paths = [self.write(f'{i}.nyml', f'a: {i}\n\nbody\n')
+                 for i in range(3)]
+        with nyml.SnapshotCache(self.pack) as cache:
+            for path in paths:
+                cache.load(path, schema, 'text')
+
+        with nyml.SnapshotCache(self.pack) as cache:
+            self.assertEqual(3, len(cache.index))
+            self.assertEqual({'a': 1, 'text': 'body\n'},
+                             cache.load(paths[1], schema, 'text'))
+            self.assertFalse(cache.pending)
+
+    def test_changes(self):
+        schema = make_schema_from_string(self.schema_text)
+        first = self.write('first.nyml', 'a: 1\n')
+        second = self.write('second.nyml', 'a: 2\n')
+        with nyml.SnapshotCache(self.pack) as cache:
+            cache.load(first, schema)
+            cache.load(second, schema)
+
+        self.write('first.nyml', 'a: 3\n')
+        with nyml.SnapshotCache(self.pack) as cache:
+            self.assertEqual({'a': 3}, cache.load(first, schema))
+            self.assertEqual({'a': 2}, cache.load(second, schema))
+            self.assertEqual(1, len(cache.pending))
+
+        with nyml.SnapshotCache(self.pack) as cache:
+            self.assertEqual({'a': 3}, cache.load(first, schema))
+            # A different schema replaces the entry
+            self.assertEqual({'a': '2'}, cache.load(second))
+            self.assertEqual(1, len(cache.pending))
+
+        with nyml.SnapshotCache(self.pack) as cache:
+            self.assertEqual({'a': '2'}, cache.load(second))
+            self.assertFalse(cache.pending)
+
+    def test_damaged_pack(self):
+        path = self.write('a.nyml', 'a: 1\n')
+        with open(self.pack, 'wb') as f:
+            f.write(b'garbage' * 10)
+        with nyml.SnapshotCache(self.pack) as cache:
+            self.assertEqual({'a': '1'}, cache.load(path))
+        with nyml.SnapshotCache(self.pack) as cache:
+            self.assertEqual(1, len(cache.index))
+
+    def test_concurrent_saves(self):
+        paths = [self.write(f'{i}.nyml', f'a: {i}\n') for i in range(4)]
+        with nyml.SnapshotCache(self.pack) as cache:
+            cache.load(paths[0])
+
+        # Both caches saw the same pack, each saves on top of the other
+        first = nyml.SnapshotCache(self.pack)
+        second = nyml.SnapshotCache(self.pack)
+        first.load(paths[1])
+        second.load(paths[2])
+        first.close()
+        second.close()
+        second = nyml.SnapshotCache(self.pack)
+        first = nyml.SnapshotCache(self.pack)
+        second.load(paths[3])
+        second.close()
+        first.close()
+
+        with nyml.SnapshotCache(self.pack) as cache:
+            self.assertEqual(4, len(cache.index))
+            for i, path in enumerate(paths):
+                self.assertEqual({'a': str(i)}, cache.load(path))
+            self.assertFalse(cache.pending)
+
+
+class NymlLazyDecodeTests(unittest.TestCase):
+    schema_text = NymlCompiledSchemaTests.schema_text
+    texts = NymlCompiledSchemaTests.texts[1:]
+
+    def test_same_as_decode(self):
+        schema = make_schema_from_string(self.schema_text)
+        for text in self.texts:
+            data = nyml.loads(text, schema, lazy=True)
+            self.assertIsInstance(data, nyml.LazyDict)
+            self.assertEqual(nyml.loads(text, schema), data)
+            self.assertEqual(nyml.loads(text, schema),
+                             nyml.materialize(data))
+            self.assertIs(dict, type(data.materialize()['meta']))
+
+    def test_decoded_on_access(self):
+        schema = make_schema_from_string(self.schema_text)
+        data = nyml.loads('id: 5\ncounts:\n- 1\n- x\n', schema, lazy=True)
+        self.assertEqual(5, data['id'])
+        self.assertEqual(['id'], list(data.decoded))
+        self.assertIn('meta', data)
+        self.assertEqual(3, data['meta']['level'])
+        self.assertIs(data['meta'], data['meta'])
+        counts = data['counts']
+        self.assertEqual(2, len(counts))
+        self.assertEqual(1, counts[0])
+        with self.assertRaises(nyml.SchemaViolation):
+            counts[1]
+        with self.assertRaises(KeyError):
+            data['missing']
+
+    def test_key_order(self):
+        schema = make_schema_from_string(self.schema_text)
+        data = nyml.loads('extra: 1\nname: x\n', schema, lazy=True)
+        self.assertEqual(['extra', 'name', 'id', 'flag', 'tags', 'counts',
+                          'meta', 'vars'], list(data))
+        self.assertEqual(8, len(data))
+
+
+class NymlSelectTests(unittest.TestCase):
+    text = ('title: Hello\n'
+            'tags:\n'
+            '- a\n'
+            '- b\n'
+            'meta:\n'
+            '  date: 2020-01-01\n'
+            '  size: 5\n'
+            '  authors:\n'
+            '    + name: x\n'
+            '      mail: y\n'
+            'other: |\n'
+            '  text\n'
+            '\n'
+            'body\n')
+
+    schema_text = ('type: dict\n'
+                   'schemas:\n'
+                   '  title:\n'
+                   '    default: untitled\n'
+                   '  count:\n'
+                   '    type: int\n'
+                   '    default: 4\n'
+                   '  meta:\n'
+                   '    type: dict\n'
+                   '    schemas:\n'
+                   '      size:\n'
+                   '        type: int\n'
+                   '      hidden:\n'
+                   '        type: bool\n')
+
+    def test_select(self):
+        self.assertEqual({'title': 'Hello', 'tags': ['a', 'b']},
+                         nyml.loads(self.text, select=['title', 'tags']))
+        self.assertEqual({'meta': {'date': '2020-01-01',
+                                   'authors': [{'name': 'x'}]}},
+                         nyml.loads(self.text,
+                                    select=['meta/date', 'meta/authors/name']))
+        self.assertEqual({'meta': {'date': '2020-01-01', 'size': '5',
+                                   'authors': [{'name': 'x', 'mail': 'y'}]}},
+                         nyml.loads(self.text, select=['meta/date', 'meta']))
+        self.assertEqual({}, nyml.loads(self.text, select=['missing']))
+
+    def test_stops_early(self):
+        lines = iter(self.text.splitlines(keepends=True))
+        self.assertEqual({'title': 'Hello'}, nyml.load(lines, select=['title']))
+        self.assertEqual('- a\n', next(lines))
+
+    def test_text_key(self):
+        self.assertEqual({'tags': ['a', 'b'], 'text': 'body\n'},
+                         nyml.loads(self.text, text_key='text',
+                                    select=['tags']))
+
+    def test_schema(self):
+        schema = make_schema_from_string(self.schema_text)
+        self.assertEqual({'meta': {'size': 5, 'hidden': False},
+                          'count': 4},
+                         nyml.loads(self.text, schema,
+                                    select=['meta/size', 'meta/hidden',
+                                            'count']))
+        self.assertEqual({'meta': {'size': 0, 'hidden': False}},
+                         nyml.loads('title: x\n', schema, select=['meta']))
+        with self.assertRaises(nyml.SchemaViolation):
+            nyml.loads('meta:\n  size: x\n', schema, select=['meta'])
+
+
+class NymlFrozenTests(unittest.TestCase):
+    schema_text = NymlCompiledSchemaTests.schema_text
+    texts = NymlCompiledSchemaTests.texts
+
+    def test_same_as_decode(self):
+        schema = make_schema_from_string(self.schema_text)
+        for text in self.texts:
+            data = nyml.loads(text, schema, frozen=True)
+            self.assertIsInstance(data, nyml.FrozenDict)
+            self.assertEqual(nyml.loads(text, schema), data)
+            self.assertEqual(list(nyml.loads(text, schema)), list(data))
+
+    def test_immutable(self):
+        schema = make_schema_from_string(self.schema_text)
+        data = nyml.loads('counts:\n- 1\n', schema, frozen=True)
+        with self.assertRaises(TypeError):
+            data['id'] = 2
+        with self.assertRaises(TypeError):
+            data['counts'].append(2)
+        with self.assertRaises(TypeError):
+            data['meta'].pop('level')
+        self.assertIs(data, copy.deepcopy(data))
+        self.assertEqual(data, pickle.loads(pickle.dumps(data)))
+        self.assertIsInstance(pickle.loads(pickle.dumps(data))['counts'],
+                              nyml.FrozenList)
+
+    def test_shared_defaults(self):
+        schema = make_schema_from_string(self.schema_text)
+        first = nyml.loads('id: 1\n', schema, frozen=True)
+        second = nyml.loads('id: 2\n', schema, frozen=True)
+        self.assertIs(first['tags'], second['tags'])
+        self.assertIs(first['meta'], second['meta'])
+        self.assertEqual(['a'], nyml.loads('', schema)['tags'])
+
+    def test_without_schema(self):
+        data = nyml.loads('a:\n- b\n', frozen=True)
+        self.assertIsInstance(data['a'], nyml.FrozenList)
+
+    def test_dumps(self):
+        schema = make_schema_from_string(self.schema_text)
+        text = 'id: 7\nname: x\n\nbody\n'
+        data = nyml.loads(text, schema, 'text', frozen=True)
+        self.assertEqual(text, nyml.dumps(data, schema, 'text'))
+
+    def test_violation_order(self):
+        schema = make_schema_from_string(self.schema_text)
+        text = 'meta:\n  level: x\nid: y\n'
+        with self.assertRaises(nyml.SchemaViolation) as cm:
+            nyml.loads(text, schema)
+        with self.assertRaises(nyml.SchemaViolation) as cm2:
+            nyml.loads(text, schema, frozen=True)
+        self.assertEqual(str(cm.exception), str(cm2.exception))
+        data = nyml.loads('tags:\n- b\nid: 1\n', schema, frozen=True)
+        self.assertEqual(['tags', 'id'], list(data)[:2])
+
+    def test_str_containers(self):
+        # str lets containers through, they are frozen all the same
+        schema = nyml.make_schema({'type': 'dict',
+                                   'schemas': {'a': {'type': 'str'}}})
+        data = nyml.loads('a:\n- x\n', schema, frozen=True)
+        self.assertEqual({'a': ['x']}, data)
+        with self.assertRaises(TypeError):
+            data['a'].append('y')
+        schema = nyml.make_schema({'type': 'list', 'schema': {'type': 'str'}})
+        data = nyml.loads('+ - x\n', schema, frozen=True)
+        self.assertEqual([['x']], data)
+        with self.assertRaises(TypeError):
+            data[0].append('y')
+
+    def test_conflicting_modes(self):
+        schema = make_schema_from_string(self.schema_text)
+        for modes in ({'lazy': True, 'frozen': True},
+                      {'frozen': True, 'records': True},
+                      {'lazy': True, 'records': True},
+                      {'select': ['id'], 'lazy': True},
+                      {'select': ['id'], 'records': True}):
+            with self.assertRaises(ValueError):
+                nyml.loads('id: 1\n', schema, **modes)
+        data = nyml.loads('id: 1\n', schema, select=['id'], frozen=True)
+        self.assertEqual({'id': 1}, data)
+
+
+class NymlRecordTests(unittest.TestCase):
+    schema_text = NymlCompiledSchemaTests.schema_text
+    texts = NymlCompiledSchemaTests.texts
+
+    def test_same_as_decode(self):
+        schema = make_schema_from_string(self.schema_text)
+        for text in self.texts:
+            data = nyml.loads(text, schema, records=True)
+            self.assertIsInstance(data, nyml.Record)
+            self.assertIsInstance(data['meta'], nyml.Record)
+            self.assertEqual(nyml.loads(text, schema), data)
+
+    def test_access(self):
+        schema = make_schema_from_string(self.schema_text)
+        data = nyml.loads('id: 3\nextra: x\n', schema, records=True)
+        self.assertEqual(3, data.id)
+        self.assertEqual(3, data['id'])
+        self.assertEqual('x', data['extra'])
+        self.assertEqual(3, data.meta.level)
+        self.assertEqual(['id', 'flag', 'name', 'tags', 'counts', 'meta',
+                          'vars', 'extra'], list(data))
+        data['id'] = 4
+        data['other'] = 'y'
+        self.assertEqual(4, data.id)
+        self.assertEqual('y', data['other'])
+        self.assertNotIn('missing', data)
+        with self.assertRaises(KeyError):
+            data['missing']
+        with self.assertRaises(AttributeError):
+            data.missing = 1
+
+    def test_odd_keys(self):
+        schema = make_schema_from_string('type: dict\n'
+                                         'schemas:\n'
+                                         '  items:\n'
+                                         '    type: int\n'
+                                         '  with space:\n'
+                                         '  class:\n'
+                                         '  _extra:\n')
+        data = nyml.loads('items: 1\nwith space: a\nclass: b\n_extra: c\n',
+                          schema, records=True)
+        self.assertEqual({'items': 1, 'with space': 'a', 'class': 'b',
+                          '_extra': 'c'}, dict(data.items()))
+
+    def test_dumps(self):
+        schema = make_schema_from_string(self.schema_text)
+        text = ('id: 7\n'
+                'name: x\n'
+                'counts:\n'
+                '- 1\n'
+                'meta:\n'
+                '  level: 5\n'
+                'extra: y\n'
+                '\n'
+                'body\n')
+        data = nyml.loads(text, schema, 'text', records=True)
+        self.assertEqual(text, nyml.dumps(data, schema, 'text'))
+
+    def test_pickle_schema(self):
+        schema = make_schema_from_string(self.schema_text)
+        text = self.texts[0]
+        expected = nyml.loads(text, schema, records=True)
+        copied = pickle.loads(pickle.dumps(schema))
+        self.assertEqual(expected, nyml.loads(text, copied, records=True))
+
+
+class NymlStatsTests(unittest.TestCase):
+    schema_text = NymlCompiledSchemaTests.schema_text
+
+    def test_load(self):
+        schema = make_schema_from_string(self.schema_text)
+        text = 'id: 1\ncounts:\n- 1\n- 2\n\nbody\n'
+        stats = nyml.Stats()
+        nyml.loads(text, schema, 'text', stats=stats)
+        counts = stats.as_dict()['counts']
+        self.assertEqual(6, counts['lines'])
+        self.assertEqual(len(text), counts['input_chars'])
+        self.assertEqual((1, 1, 4), (counts['dicts'], counts['lists'],
+                                     counts['scalars']))
+        self.assertEqual(5, counts['defaults'])
+        self.assertEqual(2, stats.as_dict()['maxima']['depth'])
+        self.assertEqual({'parse', 'decode'}, set(stats.as_dict()['times']))
+
+    def test_dumps(self):
+        schema = make_schema_from_string(self.schema_text)
+        stats = nyml.Stats()
+        text = nyml.dumps({'id': 1, 'name': 'x'}, schema, stats=stats)
+        self.assertEqual(len(text), stats.as_dict()['counts']['output_chars'])
+        # Dicts are encoded while they are written
+        self.assertEqual({'emit'}, set(stats.as_dict()['times']))
+        nyml.dumps('1', nyml.make_schema({'type': 'int'}), stats=stats)
+        self.assertEqual({'encode', 'emit'}, set(stats.as_dict()['times']))
+
+    def test_merge(self):
+        first = nyml.Stats()
+        nyml.loads('a:\n  b:\n    c: d\n', stats=first)
+        second = pickle.loads(pickle.dumps(first))
+        nyml.loads('a: b\n', stats=second)
+        first.merge(second)
+        state = first.as_dict()
+        self.assertEqual(7, state['counts']['lines'])
+        self.assertEqual(3, state['maxima']['depth'])
+
+
+class NymlPositionIndexTests(unittest.TestCase):
+    text = ('title: Grüße\n'
+            'items:\n'
+            '+ name: a\n'
+            '  tags:\n'
+            '  - x\n'
+            '  - y\n'
+            '+ name: b\n'
+            '  count: 2\n'
+            'notes: first\n'
+            '  second\n'
+            '\n'
+            'body\n')
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'doc.nyml')
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(self.text)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_index(self):
+        index = nyml.PositionIndex()
+        data = nyml.load_file(self.path, text_key='text', index=index)
+        self.assertEqual(nyml.loads(self.text, text_key='text'), data)
+        self.assertEqual(1, index.line('title'))
+        self.assertEqual(7, index.line('items/1'))
+        self.assertEqual(8, index.line(('items', 1, 'count')))
+        encoded = self.text.encode('utf-8')
+        _, start, end, indent = index['items/0/tags']
+        self.assertEqual(b'  tags:\n  - x\n  - y\n', encoded[start:end])
+        self.assertEqual(2, indent)
+        _, start, end, _ = index['notes']
+        self.assertEqual(b'notes: first\n  second\n', encoded[start:end])
+        self.assertNotIn('text', index)
+
+    def test_load_subtree(self):
+        index = nyml.PositionIndex()
+        nyml.load_file(self.path, index=index)
+        self.assertEqual(['x', 'y'],
+                         nyml.load_subtree(self.path, index, 'items/0/tags'))
+        self.assertEqual({'name': 'b', 'count': '2'},
+                         nyml.load_subtree(self.path, index, 'items/1'))
+        self.assertEqual('first\nsecond',
+                         nyml.load_subtree(self.path, index, 'notes'))
+        schema = make_schema_from_string('type: dict\n'
+                                         'schemas:\n'
+                                         '  count:\n'
+                                         '    type: int\n')
+        self.assertEqual({'name': 'b', 'count': 2},
+                         nyml.load_subtree(self.path, index, 'items/1',
+                                           schema))
+
+    def test_violation_line(self):
+        schema = make_schema_from_string('type: dict\n'
+                                         'schemas:\n'
+                                         '  items:\n'
+                                         '    type: list\n'
+                                         '    schema:\n'
+                                         '      type: dict\n'
+                                         '      schemas:\n'
+                                         '        count:\n'
+                                         '          type: int\n')
+        with open(self.path, 'w') as f:
+            f.write('items:\n+ count: 1\n+ count: x\n')
+        with self.assertRaises(nyml.SchemaViolation) as cm:
+            nyml.load_file(self.path, schema, index=nyml.PositionIndex())
+        self.assertEqual('invalid integer value: x at line 3',
+                         str(cm.exception))
+
+    def test_load_subtree_indented_key(self):
+        # k is a key of the top level dict, indented as deep as the list
+        with open(self.path, 'w') as f:
+            f.write('c:\n  + a: 1\n  k: v\n')
+        index = nyml.PositionIndex()
+        data = nyml.load_file(self.path, index=index)
+        for path in ('c', 'c/0', 'c/0/a', 'k'):
+            node = data
+            for key in index.normalize(path):
+                node = node[key]
+            self.assertEqual(node, nyml.load_subtree(self.path, index, path))
+
+    def test_numeric_keys(self):
+        with open(self.path, 'w') as f:
+            f.write('2024:\n  title: x\n  0:\n  - a\n')
+        index = nyml.PositionIndex()
+        nyml.load_file(self.path, index=index)
+        self.assertIn('2024/title', index)
+        self.assertEqual(('2024', '0', 0), index.normalize('2024/0/0'))
+        self.assertEqual('x', nyml.load_subtree(self.path, index,
+                                                '2024/title'))
+        self.assertEqual('a', nyml.load_subtree(self.path, index, '2024/0/0'))
+        self.assertNotIn(('2024', 0), index)
+
+    def test_duplicate_keys(self):
+        # Positions below a value that a later one replaced are dropped
+        with open(self.path, 'w') as f:
+            f.write('c:\n  a:\n  - x\n  b: 1\nc:\n- z\ne: 2\n')
+        index = nyml.PositionIndex()
+        data = nyml.load_file(self.path, index=index)
+        self.assertEqual([('c',), ('c', 0), ('e',)], sorted(index.positions))
+        self.assertEqual(5, index.line('c'))
+        self.assertEqual(data['c'], nyml.load_subtree(self.path, index, 'c'))
+
+
+class NymlEditableDocumentTests(unittest.TestCase):
+    text = ('a: 1\n'
+            'b:\n'
+            '  - x\n'
+            '  - y\n'
+            'c: 3\n')
+    schema = nyml.make_schema({'type': 'dict',
+                               'schemas': {'a': {'type': 'int'},
+                                           'b': {'type': 'list'},
+                                           'c': {'type': 'int'},
+                                           'd': {'type': 'int',
+                                                 'default': '4'}}})
+
+    def check(self, doc):
+        self.assertEqual(nyml.loads('\n'.join(doc.lines), self.schema),
+                         doc.data)
+
+    def test_edit(self):
+        doc = nyml.EditableDocument(self.text, self.schema)
+        self.assertEqual({'a': 1, 'b': ['x', 'y'], 'c': 3, 'd': 4}, doc.data)
+        b = doc.data['b']
+
+        self.assertEqual(5, doc.edit(0, 1, 'a: 5')['a'])
+        self.assertIs(b, doc.data['b'])
+        self.check(doc)
+
+        doc.edit(4, 4, '  - z')
+        self.assertEqual(['x', 'y', 'z'], doc.data['b'])
+        self.check(doc)
+
+        doc.edit(5, 6, 'd: 7\nc: 8')
+        self.assertEqual({'a': 5, 'b': ['x', 'y', 'z'], 'c': 8, 'd': 7},
+                         doc.data)
+        self.check(doc)
+
+        doc.edit(0, len(doc.lines), '')
+        self.assertEqual({'a': 0, 'b': [], 'c': 0, 'd': 4}, doc.data)
+
+    def test_continued_text(self):
+        doc = nyml.EditableDocument('a: one\nb: two\n')
+        doc.edit(1, 2, '  more')
+        self.assertEqual({'a': 'one\nmore'}, doc.data)
+        doc.edit(1, 1, 'c:')
+        self.assertEqual({'a': 'one', 'c': 'more'}, doc.data)
+
+    def test_root_change(self):
+        doc = nyml.EditableDocument('- a\n- b\n')
+        self.assertEqual(['a', 'c'], doc.edit(1, 2, '- c'))
+        self.assertEqual({'k': 'v'}, doc.edit(0, 2, 'k: v'))
+        self.assertEqual('text', doc.edit(0, 1, 'text'))
+
+    def test_error(self):
+        doc = nyml.EditableDocument(self.text, self.schema)
+        with self.assertRaises(nyml.SchemaViolation):
+            doc.edit(0, 1, 'a: x')
+        self.assertEqual(['a: 1'], doc.lines[:1])
+        self.assertEqual(1, doc.data['a'])
+        self.assertEqual(8, doc.edit(4, 5, 'c: 8\n\nbody')['c'])
+        self.assertEqual(5, doc.header_end)
+
+    def test_duplicate_keys(self):
+        doc = nyml.EditableDocument('a: x\ne: 2\na: 3\n', self.schema)
+        self.assertEqual(3, doc.data['a'])
+        self.assertEqual(4, doc.edit(2, 3, 'a: 4')['a'])
+        self.check(doc)
+        # Removing the later entries uncovers the first one
+        with self.assertRaises(nyml.SchemaViolation):
+            doc.edit(1, 3, 'e: 2')
+        self.assertEqual(4, doc.edit(0, 1, 'a: 1')['a'])
+        self.assertEqual(1, doc.edit(1, 3, 'e: 2')['a'])
+        self.assertEqual(['a', 'e', 'b', 'c', 'd'], list(doc.data))
+        self.check(doc)
+
+    def test_violation_order(self):
+        # Keys with a schema of their own are decoded in schema order
+        for start, end, text in ((1, 3, 'c: x\na: y'),
+                                 (0, 3, 'e: 1\nc: x\nf: 1\na: y\n')):
+            doc = nyml.EditableDocument('e: 1\nc: 3\na: 2\n', self.schema)
+            lines = doc.lines[:start] + doc.split(text) + doc.lines[end:]
+            with self.assertRaises(nyml.SchemaViolation) as cm:
+                nyml.loads('\n'.join(lines), self.schema)
+            with self.assertRaises(nyml.SchemaViolation) as cm2:
+                doc.edit(start, end, text)
+            self.assertEqual(str(cm.exception), str(cm2.exception))
+
+    def test_read_only(self):
+        schema = nyml.make_schema({'type': 'dict',
+                                   'schemas': {'a': {'type': 'list'},
+                                               'b': {'type': 'list',
+                                                     'default': ['x']}}})
+        doc = nyml.EditableDocument('a:\n- 1\nd: 1\nc: 2\n', schema)
+        first = doc.data
+        for container in (first, first['a'], first['b']):
+            self.assertIsInstance(container, (nyml.FrozenDict,
+                                              nyml.FrozenList))
+            with self.assertRaises(TypeError):
+                container.clear()
+        second = doc.edit(3, 4, 'c: 3')
+        self.assertEqual({'a': ['1'], 'b': ['x'], 'c': '3', 'd': '1'}, second)
+        self.assertIs(first['a'], second['a'])
+        self.assertEqual(['x'], schema.get_default()['b'])
+
+
+class NymlLoadAllTests(unittest.TestCase):
+    schema = nyml.make_schema({'type': 'dict',
+                               'schemas': {'id': {'type': 'int'},
+                                           'tags': {'type': 'list'}}})
+
+    def test_roundtrip(self):
+        records = [{'id': i, 'tags': ['a', 'b'][:i]} for i in range(3)]
+        fp = io.StringIO()
+        nyml.dump_all(records, fp, self.schema, buffer_size=8)
+        nyml.dump_all(records[:1], fp, self.schema)
+        text = fp.getvalue()
+        # The first record is all defaults and dumps to nothing
+        self.assertEqual('\nid: 1\ntags:\n- a\n\n'
+                         'id: 2\ntags:\n- a\n- b\n\n\n', text)
+        self.assertEqual(records + records[:1],
+                         list(nyml.load_all(io.StringIO(text), self.schema)))
+
+    def test_shapes(self):
+        records = [{'c': [{}]}, {'d': '1'}, 'x\ny', ['a', []], [[]], [{}],
+                   {'e': 'multi\n\nline'}, {}, None, {'f': None}]
+        fp = io.StringIO()
+        nyml.dump_all(records, fp)
+        expected = [nyml.loads(nyml.dumps(record)) for record in records]
+        self.assertEqual(expected,
+                         list(nyml.load_all(io.StringIO(fp.getvalue()))))
+
+        for record in ('\nx', 'x\n\ny', 'x\n'):
+            with self.assertRaises(ValueError):
+                nyml.dump_all([record], io.StringIO())
+
+    def test_documents(self):
+        text = 'a: 1\n\n\n- x\n- y\n\nz'
+        self.assertEqual([{'a': '1'}, None, ['x', 'y'], 'z'],
+                         list(nyml.load_all(text.splitlines(keepends=True))))
+        self.assertEqual([], list(nyml.load_all([])))
+
+    def test_streaming(self):
+        consumed = []
+
+        def lines():
+            for i in range(3):
+                for line in (f'id: {i}\n', '\n'):
+                    consumed.append(line)
+                    yield line
+
+        records = nyml.load_all(lines(), self.schema)
+        self.assertEqual({'id': 0, 'tags': []}, next(records))
+        self.assertEqual(2, len(consumed))
+        self.assertEqual([1, 2], [record['id'] for record in records])
+
+
+class NymlLoadAllFileTests(unittest.TestCase):
+    schema = NymlLoadAllTests.schema
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'records.nyml')
+        self.records = [{'id': i, 'tags': [f'tag {j}' for j in range(i % 4)]}
+                        for i in range(50)]
+        with open(self.path, 'w') as f:
+            nyml.dump_all(self.records, f, self.schema)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_chunks(self):
+        for workers in (1, 2):
+            for chunk_size in (1, 10, 100, 1 << 20):
+                records = nyml.load_all_file(self.path, self.schema, workers,
+                                             chunk_size, prefetch=2)
+                self.assertEqual(self.records, list(records))
+
+    def test_line_breaks(self):
+        with open(self.path, 'w', newline='\r\n') as f:
+            f.write('a: 1\n\n\nb: 2\n  more\n\n- x\n')
+        with open(self.path) as f:
+            expected = list(nyml.load_all(f))
+        self.assertEqual([{'a': '1'}, None, {'b': '2\nmore'}, ['x']], expected)
+        for chunk_size in (1, 5, 100):
+            self.assertEqual(expected,
+                             list(nyml.load_all_file(self.path, workers=1,
+                                                     chunk_size=chunk_size)))
+
+    def test_empty(self):
+        open(self.path, 'w').close()
+        self.assertEqual([], list(nyml.load_all_file(self.path, workers=2)))
+
+
+class NymlAsyncTests(unittest.TestCase):
+    schema = NymlLoadAllTests.schema
+
+    class Writer:
+        def __init__(self, fail=False):
+            self.chunks = []
+            self.drains = 0
+            self.fail = fail
+
+        def write(self, data):
+            self.chunks.append(data)
+
+        async def drain(self):
+            self.drains += 1
+            if self.fail:
+                raise ConnectionResetError
+
+    def reader(self, data):
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return reader
+
+    def test_aload(self):
+        data = 'id: 7\ntags:\n- ä\n\nbody\n'.encode('utf-8')
+
+        async def load(*args, **kwargs):
+            reader = self.reader(data)
+            result = await nyml.aload(reader, *args, **kwargs)
+            return result, reader.at_eof()
+
+        self.assertEqual(({'id': 7, 'tags': ['ä']}, False),
+                         asyncio.run(load(self.schema, chunk_size=3)))
+        self.assertEqual(({'id': '7', 'tags': ['ä'], 'text': 'body\n'}, True),
+                         asyncio.run(load(text_key='text', chunk_size=3)))
+
+    def test_adump(self):
+        data = {'id': 1, 'tags': [f'tag {i}' for i in range(100)]}
+        writer = self.Writer()
+        asyncio.run(nyml.adump(data, writer, self.schema, buffer_size=16))
+        self.assertEqual(nyml.dumps(data, self.schema).encode('utf-8'),
+                         b''.join(writer.chunks))
+        self.assertGreater(len(writer.chunks), 10)
+        self.assertEqual(len(writer.chunks), writer.drains)
+
+    def test_adump_errors(self):
+        with self.assertRaises(KeyError):
+            asyncio.run(nyml.adump({'a:b': 'x'}, self.Writer()))
+        writer = self.Writer(fail=True)
+        with self.assertRaises(ConnectionResetError):
+            asyncio.run(nyml.adump(list(range(1000)), writer, buffer_size=16))
+        self.assertEqual(1, len(writer.chunks))
+
+    def test_adump_small(self):
+        data = {'id': 1, 'tags': ['a', 'b']}
+        writer = self.Writer()
+        with unittest.mock.patch('threading.Thread',
+                                 side_effect=AssertionError):
+            asyncio.run(nyml.adump(data, writer, self.schema))
+        self.assertEqual([nyml.dumps(data, self.schema).encode('utf-8')],
+                         writer.chunks)
+        self.assertEqual(1, writer.drains)
+
+    def test_adump_text(self):
+        data = {'title': 't', 'text': 'body\n' * 100}
+        expected = nyml.dumps(dict(data), text_key='text').encode('utf-8')
+        writer = self.Writer()
+        asyncio.run(nyml.adump(data, writer, text_key='text', buffer_size=64))
+        self.assertEqual(expected, b''.join(writer.chunks))
+        self.assertGreater(len(writer.chunks), 1)
+
+    def test_lazy_import(self):
+        code = 'import sys, nyml; print("asyncio" in sys.modules)'
+        result = subprocess.run([sys.executable, '-c', code],
+                                env=dict(os.environ, PYTHONPATH=SRCDIR),
+                                stdout=subprocess.PIPE, check=True)
+        self.assertEqual(b'False', result.stdout.strip())
+        self.assertTrue(callable(nyml.aload))
+
+
+class NymlLoadbTests(unittest.TestCase):
+    text = ('id: 7\r\n'
+            'name: Grüße\r\n'
+            '  second line\r\n'
+            'tags:\r\n'
+            '- a\r'
+            '- b\n'
+            '\r\n'
+            'body\r\n'
+            'more')
+
+    def test_buffers(self):
+        expected = nyml.load(io.StringIO(self.text, newline=None),
+                             text_key='text')
+        self.assertEqual('body\nmore', expected['text'])
+        data = self.text.encode('utf-8')
+        for buffer in (data, bytearray(data), memoryview(data)):
+            for block_size in (1, 5, 1024):
+                self.assertEqual(expected,
+                                 nyml.loadb(buffer, text_key='text',
+                                            block_size=block_size))
+
+    def test_mmap(self):
+        schema = NymlLoadAllTests.schema
+        with tempfile.TemporaryFile() as f:
+            f.write(self.text.encode('utf-8'))
+            f.flush()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                result = nyml.loadb(data, schema)
+                self.assertEqual(7, result['id'])
+                self.assertEqual(['a', 'b'], result['tags'])
+                self.assertEqual('Grüße\nsecond line', result['name'])
+
+    def test_no_body(self):
+        self.assertEqual({'a': '1'}, nyml.loadb(b'a: 1'))
+        self.assertEqual({'a': '1', 'text': ''},
+                         nyml.loadb(b'a: 1\n', text_key='text'))
+        self.assertIsNone(nyml.loadb(b''))
+
+
+class NymlEncodeTests(unittest.TestCase):
+    schema_definition = {
+        'type': 'dict',
+        'schemas': {'id': {'type': 'int'},
+                    'enabled': {'type': 'bool', 'default': 'yes'},
+                    'limits': {'type': 'dict', 'schema': {'type': 'int'}},
+                    'items': {'type': 'list',
+                              'schema': {'type': 'dict',
+                                         'schemas': {'n': {'type': 'int'},
+                                                     'tags': {'type': 'list'}}}}}}
+    schema = nyml.make_schema(schema_definition)
+
+    def test_encode(self):
+        data = {'extra': 'x\ny',
+                'items': [{'n': 1, 'tags': []},
+                          {'tags': ['a'], 'n': 2, 'other': None}],
+                'limits': {'low': 0, 'high': 5},
+                'id': 7,
+                'enabled': False}
+        original = copy.deepcopy(data)
+        text = ('id: 7\n'
+                'enabled: no\n'
+                'limits:\n'
+                '  high: 5\n'
+                'items:\n'
+                '+ n: 1\n'
+                '+ n: 2\n'
+                '  tags:\n'
+                '  - a\n'
+                '  other:\n'
+                'extra: x\n'
+                '  y\n')
+        self.assertEqual(text, nyml.dumps(data, self.schema))
+        self.assertEqual(text, nyml.dumps(nyml.freeze(data), self.schema))
+        self.assertEqual(original, data)
+
+    def test_defaults(self):
+        data = {'id': 0, 'enabled': True, 'limits': {'low': 0}, 'items': []}
+        self.assertEqual('', nyml.dumps(data, self.schema))
+        with self.assertRaises(KeyError):
+            nyml.dumps({'limits': {'a:b': 1}}, self.schema)
+        self.assertEqual('', nyml.dumps({'limits': {'a:b': 0}}, self.schema))
+
+
+class NymlCompiledDumperTests(unittest.TestCase):
+    schema_definition = NymlEncodeTests.schema_definition
+    schema = NymlEncodeTests.schema
+
+    def check(self, schema, *records):
+        dump = schema.compile_dumper()
+        for data in records:
+            self.assertEqual(nyml.dumps(data, schema), dump(data))
+
+    def test_dumper(self):
+        records = [{'id': i,
+                    'enabled': i % 2 == 0,
+                    'limits': {'low': i % 3, 'high': 10},
+                    'items': [{'n': j + 1, 'tags': ['a', 'b'][:j]}
+                              for j in range(i % 4)],
+                    'other': 'x' if i % 3 else None}
+                   for i in range(20)]
+        self.check(self.schema, *records)
+        dump = self.schema.compile_dumper()
+        self.assertEqual('id: 1\nenabled: no\nlimits:\n  low: 1\n'
+                         '  high: 10\nitems:\n+ n: 1\nother: x\n',
+                         dump(records[1]))
+        self.check(self.schema, *map(nyml.freeze, records))
+        records = nyml.loads(nyml.dumps(records[:3], nyml.make_schema(
+                {'type': 'list', 'schema': self.schema_definition})))
+        self.check(self.schema, *map(self.schema.decode_records, records))
+
+    def test_fallback(self):
+        self.check(self.schema,
+                   {'id': 1, 'other': 'multi\nline'},
+                   {'items': [{'n': 'x\ny'}]},
+                   {'limits': {'low': {'nested': 'dict'}}},
+                   {'enabled': True, 'extra': {'a': ['b']}},
+                   None, '', [], {})
+        with self.assertRaises(KeyError):
+            self.schema.compile_dumper()({'a:b': 'x'})
+        self.check(nyml.make_schema({'type': 'int'}), 1, 0)
+
+    def test_lists(self):
+        schema = nyml.make_schema({'type': 'list',
+                                   'schema': {'type': 'list',
+                                              'schema': {'type': 'bool'}}})
+        self.check(schema, [[True, False], [], [False]], [])
+
+    def test_deep(self):
+        definition = {'type': 'int'}
+        data = 5
+        for i in range(10):
+            if i % 3 == 2:
+                definition = {'type': 'list', 'schema': definition}
+                data = [data, data]
+            else:
+                definition = {'type': 'dict',
+                              'schemas': {f'k{i}': definition,
+                                          'z': {'type': 'bool'}}}
+                data = {f'k{i}': data, 'z': i % 2 == 0, 'e': 'x'}
+        self.check(nyml.make_schema(definition), data)
+
+
 if __name__ == '__main__':
     unittest.main()